@@ -0,0 +1,207 @@
+"""Anthropic Messages API 的 agent 迴圈
+
+client_claude、client_sse 與 client_http 共用：
+- 同一個回覆中的所有 tool_use 一起執行，結果放在同一則 user 訊息的
+  tool_result 區塊中一次送回，N 個工具呼叫只需要一次往返
+- 每次呼叫模型都帶著 tools，模型可以連續多步使用工具，
+  直到不再使用工具或達到 MAX_ROUNDS 為止
+- 工具以 asyncio task 並行執行；串流模式下文字一邊產生一邊顯示，
+  每個 tool_use 的參數一完整就開始執行，不必等整個回覆結束
+- 在工具清單、這次提問（之前的對話都不會再變動）以及最新一則訊息
+  加上 cache_control，讓工具定義與對話前段可以使用提示快取
+"""
+import asyncio
+
+MODEL = "claude-3-7-sonnet-20250219"
+MAX_TOKENS = 1000
+MAX_ROUNDS = 10 # 一次提問最多呼叫模型幾次
+CACHE_CONTROL = {"type": "ephemeral"}
+
+def tool_definitions(tools, cache=False):
+    """把 MCP 的工具清單轉成 Messages API 的 tools 參數
+
+    工具依名稱排序，伺服器傳回的順序改變時也不會讓快取失效
+
+    Args:
+        tools: MCP 的工具清單
+        cache: 是否在最後一個工具加上快取斷點，快取整個工具清單
+    """
+    definitions = [{
+        "name": tool.name,
+        "description": tool.description,
+        "input_schema": tool.inputSchema
+    } for tool in sorted(tools, key=lambda tool: tool.name)]
+    if cache and definitions:
+        definitions[-1]["cache_control"] = CACHE_CONTROL
+    return definitions
+
+def with_breakpoints(messages, indexes):
+    """在指定訊息的最後一個內容區塊加上 cache_control
+
+    傳回新的訊息串列，不修改原本的訊息，對話紀錄中不會留下斷點
+    """
+    marked = list(messages)
+    for index in indexes:
+        message = messages[index]
+        content = message["content"]
+        if not content:
+            continue
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        last = content[-1]
+        if not isinstance(last, dict):
+            last = last.model_dump(exclude_none=True)
+        marked[index] = {
+            **message,
+            "content": [*content[:-1], {**last, "cache_control": CACHE_CONTROL}]
+        }
+    return marked
+
+def result_blocks(content):
+    """把 MCP 工具結果轉成 tool_result 可以接受的內容區塊"""
+    blocks = []
+    for item in content:
+        if item.type == "text":
+            blocks.append({"type": "text", "text": item.text})
+        elif item.type == "image":
+            blocks.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": item.mimeType,
+                    "data": item.data
+                }
+            })
+    return blocks
+
+def result_text(tool_result):
+    """取出 tool_result 中的文字，顯示用"""
+    content = tool_result["content"]
+    if isinstance(content, str):
+        return content
+    return "\n".join(block["text"] for block in content
+                     if block["type"] == "text")
+
+async def run_tool(session, block):
+    """執行一個 tool_use，傳回對應的 tool_result 區塊
+
+    工具失敗時不丟出例外，而是以 is_error 把錯誤訊息交給模型
+    """
+    try:
+        result = await session.call_tool(block.name, block.input)
+    except Exception as e:
+        return {
+            "type": "tool_result",
+            "tool_use_id": block.id,
+            "content": f"Error: {e}",
+            "is_error": True
+        }
+    tool_result = {
+        "type": "tool_result",
+        "tool_use_id": block.id,
+        "content": result_blocks(result.content)
+    }
+    if result.isError:
+        tool_result["is_error"] = True
+    return tool_result
+
+async def create_message(anthropic, session, **kwargs):
+    """呼叫模型，並為回覆中的每個 tool_use 開始執行工具
+
+    Returns:
+        (message, tasks)，tasks 是與 tool_use 順序相同的工具呼叫
+    """
+    message = await anthropic.messages.create(**kwargs)
+    tasks = [
+        asyncio.create_task(run_tool(session, block))
+        for block in message.content if block.type == "tool_use"
+    ]
+    return message, tasks
+
+async def stream_message(anthropic, session, **kwargs):
+    """以串流方式呼叫模型，文字即時顯示，工具參數一完整就開始執行
+
+    Returns:
+        (message, tasks)，與 create_message 相同
+    """
+    tasks = []
+    printed = False
+    try:
+        async with anthropic.messages.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "text":
+                    print(event.text, end="", flush=True)
+                    printed = True
+                elif (event.type == "content_block_stop"
+                      and event.content_block.type == "tool_use"):
+                    tasks.append(asyncio.create_task(
+                        run_tool(session, event.content_block)
+                    ))
+            message = await stream.get_final_message()
+    except BaseException:
+        # 串流中斷時取消已經開始的工具呼叫
+        for task in tasks:
+            task.cancel()
+        raise
+    if printed:
+        print()
+    return message, tasks
+
+async def run_agent(anthropic, session, tools, messages, model=MODEL,
+                    max_tokens=MAX_TOKENS, stream=False, usage=None):
+    """反覆呼叫模型與工具，直到模型不再使用工具
+
+    Args:
+        anthropic: AsyncAnthropic 用戶端
+        session: 執行工具的 MCP ClientSession
+        tools: MCP 的工具清單
+        messages: 對話內容，會就地加入這次的回覆與工具結果
+        model: 模型名稱
+        max_tokens: 每次回覆的 token 上限
+        stream: 是否以串流方式呼叫模型並即時顯示文字
+        usage: 可選的 llm_clients.TokenUsage，累計每次呼叫的 token 數
+
+    Returns:
+        所有回覆文字與工具呼叫紀錄
+    """
+    available_tools = tool_definitions(tools, cache=True)
+    call = stream_message if stream else create_message
+    final_text = []
+    prefix_end = len(messages) - 1 # 這次的提問，之前的內容都已固定
+
+    for _ in range(MAX_ROUNDS):
+        message, tasks = await call(
+            anthropic, session,
+            model=model,
+            max_tokens=max_tokens,
+            messages=with_breakpoints(
+                messages, sorted({prefix_end, len(messages) - 1})
+            ),
+            tools=available_tools
+        )
+        if usage is not None:
+            usage.add(message.usage)
+        messages.append({"role": "assistant", "content": message.content})
+        if not tasks:
+            final_text += [block.text for block in message.content
+                           if block.type == "text"]
+            break
+
+        # 工具都已開始執行，這裡只等待全部完成，結果一次送回
+        results = await asyncio.gather(*tasks)
+        messages.append({"role": "user", "content": list(results)})
+        results = iter(results)
+        for block in message.content:
+            if block.type == "text":
+                final_text.append(block.text)
+            elif block.type == "tool_use":
+                text = (
+                    f"\n[Calling tool {block.name} with args {block.input}]\n\n"
+                    f"{result_text(next(results))}\n\n"
+                )
+                final_text.append(text)
+                if stream: # 串流模式下呼叫端不會再顯示最後的結果
+                    print(text)
+    else:
+        final_text.append(f"[Stopped after {MAX_ROUNDS} rounds]")
+    return "\n".join(final_text)
@@ -0,0 +1,184 @@
+"""以本機的假 Messages API 比較 agent 迴圈的模型往返次數
+
+用法：uv run bench_anthropic_loop.py [每步工具數] [步數]
+
+假模型在有 tools 參數時，每一步回覆指定數量的 tool_use，
+收到指定步數的工具結果後才回覆文字。比較原本 client_sse.py 的
+作法（每個 tool_use 各呼叫一次模型且不帶 tools）與 anthropic_loop
+（一般與串流模式）的模型往返次數、實際執行的工具步數與耗時。
+每個工具呼叫花費 TOOL_DELAY 秒。
+"""
+import asyncio
+import json
+import sys
+import time
+import types
+
+from anthropic import AsyncAnthropic
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import anthropic_loop
+from bench_util import start_stub
+
+TOOL_DELAY = 0.2 # 每個工具呼叫的秒數
+MODEL_DELAY = 0.1 # 假模型每次回覆的秒數
+
+class Stub:
+    calls_per_step = 3
+    steps = 2
+    requests = 0
+
+def tool_rounds(messages):
+    """對話中已經送回幾輪 tool_result"""
+    return sum(
+        1 for message in messages
+        if message["role"] == "user" and isinstance(message["content"], list)
+        and any(block.get("type") == "tool_result"
+                for block in message["content"])
+    )
+
+def reply_blocks(body):
+    done = tool_rounds(body["messages"])
+    if "tools" in body and done < Stub.steps:
+        return [{
+            "type": "tool_use",
+            "id": f"toolu_{done}_{i}",
+            "name": "slow",
+            "input": {"step": done, "no": i}
+        } for i in range(Stub.calls_per_step)], "tool_use"
+    return [{"type": "text", "text": f"Done after {done} tool steps."}], "end_turn"
+
+def message(content, stop_reason):
+    return {
+        "id": "msg_stub", "type": "message", "role": "assistant",
+        "model": "stub", "content": content, "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": 10, "output_tokens": 10}
+    }
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_events(content, stop_reason):
+    start = message([], None)
+    yield sse("message_start", {"type": "message_start", "message": start})
+    for index, block in enumerate(content):
+        await asyncio.sleep(MODEL_DELAY / len(content))
+        if block["type"] == "text":
+            yield sse("content_block_start", {
+                "type": "content_block_start", "index": index,
+                "content_block": {"type": "text", "text": ""}})
+            yield sse("content_block_delta", {
+                "type": "content_block_delta", "index": index,
+                "delta": {"type": "text_delta", "text": block["text"]}})
+        else:
+            yield sse("content_block_start", {
+                "type": "content_block_start", "index": index,
+                "content_block": {**block, "input": {}}})
+            yield sse("content_block_delta", {
+                "type": "content_block_delta", "index": index,
+                "delta": {"type": "input_json_delta",
+                          "partial_json": json.dumps(block["input"])}})
+        yield sse("content_block_stop",
+                  {"type": "content_block_stop", "index": index})
+    yield sse("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+        "usage": {"output_tokens": 10}})
+    yield sse("message_stop", {"type": "message_stop"})
+
+async def messages(request):
+    Stub.requests += 1
+    body = await request.json()
+    content, stop_reason = reply_blocks(body)
+    if body.get("stream"):
+        return StreamingResponse(stream_events(content, stop_reason),
+                                 media_type="text/event-stream")
+    await asyncio.sleep(MODEL_DELAY)
+    return JSONResponse(message(content, stop_reason))
+
+class FakeSession:
+    """模擬 MCP ClientSession，記錄執行過的工具步數"""
+    def __init__(self):
+        self.steps = set()
+
+    async def call_tool(self, name, args):
+        await asyncio.sleep(TOOL_DELAY)
+        self.steps.add(args["step"])
+        return types.SimpleNamespace(
+            isError=False,
+            content=[types.SimpleNamespace(type="text", text="ok")]
+        )
+
+TOOLS = [types.SimpleNamespace(
+    name="slow", description="A slow tool",
+    inputSchema={"type": "object", "properties": {}}
+)]
+
+async def legacy_process_query(anthropic, session, query):
+    """原本 client_sse.py 的 process_query"""
+    messages = [{"role": "user", "content": query}]
+    available_tools = anthropic_loop.tool_definitions(TOOLS)
+    response = await anthropic.messages.create(
+        model="stub", max_tokens=1000, messages=messages,
+        tools=available_tools
+    )
+    final_text = []
+    for content in response.content:
+        if content.type == 'text':
+            final_text.append(content.text)
+        elif content.type == 'tool_use':
+            result = await session.call_tool(content.name, content.input)
+            final_text.append(f"[Calling tool {content.name}]")
+            messages.append({
+                "role": "user",
+                "content": [{"type": "text", "text": result.content[0].text}]
+            })
+            response = await anthropic.messages.create(
+                model="stub", max_tokens=1000, messages=messages,
+            )
+            final_text.append(response.content[0].text)
+    return "\n".join(final_text)
+
+async def run(name, process_query, base_url):
+    anthropic = AsyncAnthropic(base_url=base_url, api_key="stub")
+    session = FakeSession()
+    Stub.requests = 0
+    start = time.perf_counter()
+    await process_query(anthropic, session, "Go")
+    elapsed = time.perf_counter() - start
+    print(f"{name:16}{Stub.requests:10}{len(session.steps):10}"
+          f"{elapsed:10.2f}")
+    await anthropic.close()
+
+async def main(base_url):
+    Stub.calls_per_step = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    Stub.steps = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    print(f"每步 {Stub.calls_per_step} 個工具呼叫，共 {Stub.steps} 步，"
+          f"工具 {TOOL_DELAY} 秒，模型 {MODEL_DELAY} 秒")
+    print(f"{'':16}{'模型往返':>6}{'完成步數':>6}{'秒數':>8}")
+
+    def agent(stream):
+        async def process_query(anthropic, session, query):
+            return await anthropic_loop.run_agent(
+                anthropic, session, TOOLS,
+                [{"role": "user", "content": query}],
+                model="stub", stream=stream
+            )
+        return process_query
+
+    await run("原本的迴圈", legacy_process_query, base_url)
+    await run("anthropic_loop", agent(False), base_url)
+    # 串流模式會顯示回覆文字
+    await run("串流模式", agent(True), base_url)
+
+if __name__ == "__main__":
+    server, port = start_stub(Starlette(routes=[
+        Route("/v1/messages", messages, methods=["POST"])
+    ]))
+    try:
+        asyncio.run(main(f"http://127.0.0.1:{port}"))
+    finally:
+        server.should_exit = True
@@ -0,0 +1,120 @@
+"""以會限流的本機假搜尋服務測試 SearchScheduler
+
+用法：uv run bench_google_search.py [搜尋數] [並行數]
+
+假服務每秒只接受 STUB_RATE 個請求，超過時回應 429，並在接下來
+STUB_PENALTY 秒內拒絕所有請求，模擬 Google 限流後持續封鎖的情況。
+比較直接送出請求與經過 SearchScheduler 排程的成功數、429 次數、
+吞吐量與延遲。排程器的速率故意設得比假服務的上限高，
+以顯示被限流後自動降速的效果。
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import time
+
+import requests
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from bench_util import latency_ms, start_stub
+from search_scheduler import SearchScheduler
+
+STUB_RATE = 5.0      # 假服務每秒接受的請求數
+STUB_PENALTY = 2.0   # 超過速率後封鎖的秒數
+SCHEDULER_RATE = 8.0 # 排程器一開始的速率，故意高於 STUB_RATE
+SCHEDULER_BURST = 3
+
+class StubState:
+    tokens = STUB_RATE
+    updated = time.monotonic()
+    blocked_until = 0.0
+    throttled = 0
+    lock = threading.Lock()
+
+async def search(request):
+    with StubState.lock:
+        now = time.monotonic()
+        StubState.tokens = min(
+            StubState.tokens + (now - StubState.updated) * STUB_RATE,
+            STUB_RATE
+        )
+        StubState.updated = now
+        if now < StubState.blocked_until or StubState.tokens < 1:
+            StubState.throttled += 1
+            StubState.blocked_until = max(StubState.blocked_until,
+                                          now + STUB_PENALTY)
+            return PlainTextResponse("Too Many Requests", status_code=429)
+        StubState.tokens -= 1
+    await asyncio.sleep(0.05)
+    return PlainTextResponse(f"- [result]({request.query_params['q']})\n")
+
+def reset_stub():
+    with StubState.lock:
+        StubState.tokens = STUB_RATE
+        StubState.updated = time.monotonic()
+        StubState.blocked_until = 0.0
+        StubState.throttled = 0
+
+async def run(name, url, total, concurrency, use_scheduler):
+    reset_stub()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    session = requests.Session()
+
+    def backend(query):
+        # 和 googlesearch 一樣以 requests 送出並在錯誤時丟出 HTTPError
+        response = session.get(url, params={"q": query}, timeout=10)
+        response.raise_for_status()
+        return response.text
+
+    scheduler = SearchScheduler(SCHEDULER_RATE, burst=SCHEDULER_BURST,
+                                executor=executor, max_queue=total,
+                                max_retries=10, backoff_base=0.5)
+    loop = asyncio.get_running_loop()
+    latencies = []
+    failures = 0
+    queue = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for i in queue:
+            start = time.perf_counter()
+            try:
+                if use_scheduler:
+                    await scheduler.run(backend, f"q{i}")
+                else:
+                    await loop.run_in_executor(executor, backend, f"q{i}")
+            except Exception:
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+
+    done = len(latencies)
+    p50, p99 = latency_ms(latencies)
+    depth = scheduler.stats["max_depth"] if use_scheduler else "-"
+    print(f"{name:12}{done:8}{failures:8}{StubState.throttled:8}"
+          f"{done / elapsed:10.2f}{p50:10.0f}{p99:10.0f}{depth:>8}")
+
+async def main(url):
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f"{total} 次搜尋，並行數 {concurrency}，"
+          f"假服務上限每秒 {STUB_RATE} 次，超過後封鎖 {STUB_PENALTY} 秒")
+    print(f"{'':12}{'成功':>6}{'失敗':>6}{'429':>8}"
+          f"{'成功/秒':>7}{'p50 ms':>10}{'p99 ms':>10}{'最大佇列':>4}")
+    await run("直接送出", url, total, concurrency, False)
+    await run("排程器", url, total, concurrency, True)
+
+if __name__ == "__main__":
+    server, port = start_stub(Starlette(routes=[Route("/search", search)]))
+    try:
+        asyncio.run(main(f"http://127.0.0.1:{port}/search"))
+    finally:
+        server.should_exit = True
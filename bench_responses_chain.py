@@ -0,0 +1,278 @@
+"""以本機的假 Responses API 測試 client_with_servers 的回覆串接
+
+用法：uv run bench_responses_chain.py [每步工具數] [步數]
+
+假模型在對話中的工具結果少於指定步數時回覆指定數量的
+function_call，否則回覆文字。以 client_with_servers.get_reply_text
+分別在一般與串流模式下比較完整傳送與 previous_response_id 串接的
+模型往返次數、送出的 input 項目數與耗時，並檢查：
+- 每個 function_call 都收到對應 call_id 的 function_call_output
+- 串接模式下每次工具執行後都以 previous_response_id 接續，
+  只送出新的 function_call_output
+- 伺服器不接受串接時改回完整傳送，並關閉串接模式
+- 與串接無關的錯誤（例如對話太長）直接丟出，不關閉串接模式，
+  也不重送一次
+- 部分工具呼叫失敗（丟出例外或沒有傳回內容）時，其他工具呼叫的
+  結果仍然送回，失敗的呼叫以 tool_error 回報
+任何一項不符合時以非 0 的結束碼結束。
+"""
+from contextlib import redirect_stdout
+import asyncio
+import io
+import json
+import sys
+import time
+import types
+
+from openai import AsyncOpenAI, BadRequestError
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from bench_util import start_stub
+import client_with_servers
+from tool_router import ToolRouter
+
+TOOL_DELAY = 0.05 # 每個工具呼叫的秒數
+
+class Stub:
+    calls_per_step = 3
+    steps = 2
+    reject_chain = False # 不接受 previous_response_id
+    fail_chain = False   # 串接的請求一律回應與串接無關的錯誤
+    stored = {}          # 回覆 id -> (已完成的工具步數, 這次回覆的 call_id)
+    requests = 0
+    chained = 0
+    items = 0            # 所有請求送出的 input 項目數
+    errors = []          # 對話內容不一致的紀錄
+    tool_errors = 0      # 收到的 tool_error 結果數
+
+    @classmethod
+    def reset(cls, reject_chain=False, fail_chain=False):
+        cls.reject_chain = reject_chain
+        cls.fail_chain = fail_chain
+        cls.stored = {}
+        cls.requests = cls.chained = cls.items = cls.tool_errors = 0
+        cls.errors = []
+
+def error(status, message, param, code):
+    return JSONResponse({"error": {
+        "message": message, "type": "invalid_request_error",
+        "param": param, "code": code
+    }}, status_code=status)
+
+def outputs(items):
+    """input 中的 function_call_output 的 call_id"""
+    return [item["call_id"] for item in items
+            if isinstance(item, dict)
+            and item.get("type") == "function_call_output"]
+
+def pending_calls(items):
+    """完整對話中還沒有收到結果的 function_call"""
+    calls = [item["call_id"] for item in items
+             if isinstance(item, dict) and item.get("type") == "function_call"]
+    answered = set(outputs(items))
+    return [call_id for call_id in calls if call_id not in answered]
+
+def reply(done, response_id):
+    """依已完成的工具步數產生回覆的 output"""
+    if done < Stub.steps:
+        call_ids = [f"call_{response_id}_{i}"
+                    for i in range(Stub.calls_per_step)]
+        return [{
+            "type": "function_call", "id": f"fc_{call_id}",
+            "call_id": call_id, "name": "slow",
+            "arguments": json.dumps({"step": done, "no": i}),
+            "status": "completed"
+        } for i, call_id in enumerate(call_ids)], call_ids
+    return [{
+        "type": "message", "id": f"msg_{response_id}", "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "annotations": [],
+                     "text": f"Done after {done} tool steps."}]
+    }], []
+
+def response_body(response_id, output, status="completed"):
+    return {
+        "id": response_id, "object": "response", "created_at": 0,
+        "model": "stub", "status": status, "output": output,
+        "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+        "usage": {
+            "input_tokens": 10, "output_tokens": 10, "total_tokens": 20,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens_details": {"reasoning_tokens": 0}
+        }
+    }
+
+def sse(data):
+    return f"event: {data['type']}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_events(response_id, output):
+    yield sse({"type": "response.created",
+               "response": response_body(response_id, [], "in_progress")})
+    for index, item in enumerate(output):
+        await asyncio.sleep(0.01)
+        if item["type"] == "message":
+            yield sse({"type": "response.output_text.delta",
+                       "item_id": item["id"], "output_index": index,
+                       "content_index": 0,
+                       "delta": item["content"][0]["text"]})
+        yield sse({"type": "response.output_item.done",
+                   "output_index": index, "item": item})
+    yield sse({"type": "response.completed",
+               "response": response_body(response_id, output)})
+
+async def responses(request):
+    Stub.requests += 1
+    body = await request.json()
+    items = body["input"]
+    if isinstance(items, str):
+        items = [{"role": "user", "content": items}]
+    Stub.items += len(items)
+    Stub.tool_errors += sum(
+        1 for item in items
+        if isinstance(item, dict) and item.get("type") == "function_call_output"
+        and '"tool_error"' in item["output"]
+    )
+
+    previous_id = body.get("previous_response_id")
+    if previous_id is not None:
+        if Stub.fail_chain:
+            return error(400, "Input is too long for the context window.",
+                         "input", "context_length_exceeded")
+        if Stub.reject_chain or previous_id not in Stub.stored:
+            return error(400, f"Previous response '{previous_id}' not found.",
+                         "previous_response_id", "previous_response_not_found")
+        Stub.chained += 1
+        done, expected = Stub.stored[previous_id]
+        answered = outputs(items)
+        if sorted(answered) != sorted(expected):
+            Stub.errors.append(f"串接的結果 {answered}，預期 {expected}")
+        done += 1
+    else:
+        missing = pending_calls(items)
+        if missing:
+            Stub.errors.append(f"缺少工具結果：{missing}")
+        done = len(outputs(items)) // Stub.calls_per_step
+
+    response_id = f"resp_{Stub.requests}"
+    output, call_ids = reply(done, response_id)
+    if body.get("store"):
+        Stub.stored[response_id] = (done, call_ids)
+    if body.get("stream"):
+        return StreamingResponse(stream_events(response_id, output),
+                                 media_type="text/event-stream")
+    return JSONResponse(response_body(response_id, output))
+
+class FakeClient:
+    """模擬 MCPClient，提供一個 slow 工具"""
+    name = "stub"
+    tool_names = ["slow"]
+    tools = [{"type": "function", "name": "slow", "description": "A slow tool",
+              "parameters": {"type": "object", "properties": {}}}]
+    schemas = {"slow": tools[0]["parameters"]}
+    fail = False # 第 2 個工具呼叫丟出例外，第 3 個沒有傳回內容
+
+    async def call_tool(self, name, args):
+        await asyncio.sleep(TOOL_DELAY)
+        if self.fail and args["no"] == 1:
+            raise RuntimeError("tool crashed")
+        if self.fail and args["no"] == 2:
+            return types.SimpleNamespace(content=[])
+        return types.SimpleNamespace(
+            content=[types.SimpleNamespace(type="text", text="ok")]
+        )
+
+failed = False
+
+def check(name, actual, expected):
+    global failed
+    ok = actual == expected
+    failed |= not ok
+    print(f"{'OK' if ok else 'FAIL':6}{name}：{actual}（預期 {expected}）")
+
+async def run(name, router, stream, chain, **stub):
+    """執行一次問答，傳回回覆文字，並顯示往返次數與送出的項目數
+
+    client_with_servers 顯示的工具呼叫與回覆文字不輸出
+    """
+    Stub.reset(**stub)
+    client_with_servers.STREAM_OUTPUT = stream
+    client_with_servers.CHAIN_RESPONSES = chain
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()):
+            text = await client_with_servers.get_reply_text(router, "Go", [])
+    finally:
+        elapsed = time.perf_counter() - start
+        print(f"{name:20}{Stub.requests:8}{Stub.chained:8}{Stub.items:10}"
+              f"{elapsed:10.2f}")
+    return text
+
+async def main(base_url):
+    Stub.calls_per_step = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    Stub.steps = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    client_with_servers.openai = AsyncOpenAI(base_url=base_url,
+                                             api_key="stub")
+    fake = FakeClient()
+    router = ToolRouter([fake])
+    done = f"Done after {Stub.steps} tool steps."
+    print(f"每步 {Stub.calls_per_step} 個工具呼叫，共 {Stub.steps} 步")
+    print(f"{'':20}{'模型往返':>4}{'串接':>6}{'送出項目':>6}{'秒數':>8}")
+
+    for stream in (False, True):
+        mode = "串流" if stream else "一般"
+        for chain in (False, True):
+            name = f"{mode}{'串接' if chain else '完整傳送'}"
+            text = await run(name, router, stream, chain)
+            check(f"{name}的回覆", text, done)
+            check(f"{name}的模型往返次數", Stub.requests, Stub.steps + 1)
+            check(f"{name}的串接次數", Stub.chained,
+                  Stub.steps if chain else 0)
+            check(f"{name}的對話內容錯誤", Stub.errors, [])
+
+    for stream in (False, True):
+        name = f"{'串流' if stream else '一般'}拒絕串接"
+        text = await run(name, router, stream, True, reject_chain=True)
+        check(f"{name}的回覆", text, done)
+        # 第一次串接被拒絕後改回完整傳送，之後不再嘗試串接
+        check(f"{name}的模型往返次數", Stub.requests, Stub.steps + 2)
+        check(f"{name}後的串接模式", client_with_servers.CHAIN_RESPONSES,
+              False)
+        check(f"{name}的對話內容錯誤", Stub.errors, [])
+
+    for stream in (False, True):
+        name = f"{'串流' if stream else '一般'}對話太長"
+        try:
+            await run(name, router, stream, True, fail_chain=True)
+            error = None
+        except BadRequestError as e:
+            error = e.code
+        check(f"{name}丟出的錯誤", error, "context_length_exceeded")
+        check(f"{name}的模型往返次數", Stub.requests, 2)
+        check(f"{name}後的串接模式", client_with_servers.CHAIN_RESPONSES,
+              True)
+
+    fake.fail = True
+    for stream in (False, True):
+        name = f"{'串流' if stream else '一般'}工具失敗"
+        text = await run(name, router, stream, False)
+        check(f"{name}的回覆", text, done)
+        check(f"{name}的對話內容錯誤", Stub.errors, [])
+        if Stub.calls_per_step >= 3:
+            # 完整傳送時每次請求都包含之前所有的結果
+            check(f"{name}送回的 tool_error 數", Stub.tool_errors,
+                  Stub.steps * (Stub.steps + 1))
+    fake.fail = False
+
+    await client_with_servers.openai.close()
+
+if __name__ == "__main__":
+    server, port = start_stub(Starlette(routes=[
+        Route("/v1/responses", responses, methods=["POST"])
+    ]))
+    try:
+        asyncio.run(main(f"http://127.0.0.1:{port}/v1"))
+    finally:
+        server.should_exit = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,124 @@
+"""測試 serve_google_search.py 以不同 worker 數執行時的工具呼叫吞吐量
+
+用法：uv run bench_search_workers.py [worker 數,...] [秒數] [並行數]
+
+例如 uv run bench_search_workers.py 1,2,4 10 32 會依序以 1、2、4 個
+worker 啟動伺服器，每次以 CLIENT_PROCS 個行程、合計指定的並行數，
+持續送出 google_res 工具呼叫指定的秒數，顯示每秒完成的工具呼叫數
+與延遲。伺服器一律使用無狀態的 streamable-HTTP，每個工具呼叫是
+一個獨立的 POST，不需要先初始化 session。
+
+搜尋本身換成立即傳回固定結果的假函式，每次呼叫使用不同的關鍵字，
+不會命中快取，測的是 MCP 協定處理、排程器與執行緒池的負擔。
+CPU 核心數少於 worker 數時增加 worker 不會提高吞吐量。
+"""
+from multiprocessing import Pool
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench_util import free_port, latency_ms, stop_process, wait_for_port
+from serve_google_search import serve
+
+CLIENT_PROCS = 4 # 送出請求的行程數，避免客戶端本身成為瓶頸
+HEADERS = {"Accept": "application/json, text/event-stream"}
+
+def fake_search(keyword, num_results, lang):
+    return "".join(f"- [{keyword} {i}](https://example.com/{i})\n"
+                   f"    result {i} for {keyword}\n"
+                   for i in range(num_results))
+
+def create_app():
+    """在每個 worker 中把搜尋換成假函式後建立 app"""
+    # 要在 serve() 設定好環境變數之後才匯入
+    import google_search
+    import http_google_search
+    google_search.search_markdown = fake_search
+    return http_google_search.create_app()
+
+async def load(url, concurrency, duration, client_no):
+    """持續送出工具呼叫，傳回 (成功延遲串列, 失敗數)"""
+    latencies = []
+    failures = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker(worker_no):
+            nonlocal failures
+            i = 0
+            while time.monotonic() < deadline:
+                i += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, headers=HEADERS, json={
+                        "jsonrpc": "2.0", "id": i, "method": "tools/call",
+                        "params": {
+                            "name": "google_res",
+                            "arguments": {
+                                "keyword": f"q{client_no}-{worker_no}-{i}"
+                            }
+                        }
+                    })
+                    response.raise_for_status()
+                    if response.json()["result"]["isError"]:
+                        raise RuntimeError(response.text)
+                except Exception:
+                    failures += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    return latencies, failures
+
+def run_client(url, concurrency, duration, client_no):
+    return asyncio.run(load(url, concurrency, duration, client_no))
+
+def bench(workers, duration, concurrency):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(workers), str(port)]
+    )
+    try:
+        wait_for_port(port)
+        time.sleep(1) # 等所有 worker 都開始接受連線
+        url = f"http://127.0.0.1:{port}/mcp/"
+        per_client = max(concurrency // CLIENT_PROCS, 1)
+        with Pool(CLIENT_PROCS) as pool:
+            results = pool.starmap(run_client, [
+                (url, per_client, duration, n) for n in range(CLIENT_PROCS)
+            ])
+    finally:
+        stop_process(server)
+
+    latencies = [l for result, _ in results for l in result]
+    failures = sum(failures for _, failures in results)
+    done = len(latencies)
+    p50, p99 = latency_ms(latencies)
+    print(f"{workers:8}{done:10}{failures:8}{done / duration:12.1f}"
+          f"{p50:10.1f}{p99:10.1f}", flush=True)
+
+def main():
+    counts = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1
+                               else "1,2,4").split(",")]
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    print(f"每次 {duration:g} 秒，並行數 {concurrency}，"
+          f"{CLIENT_PROCS} 個客戶端行程，CPU 核心數 {os.cpu_count()}")
+    print(f"{'workers':>8}{'完成':>8}{'失敗':>6}{'呼叫/秒':>9}"
+          f"{'p50 ms':>10}{'p99 ms':>10}", flush=True)
+    for workers in counts:
+        bench(workers, duration, concurrency)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        # 由 bench() 啟動的伺服器行程，單一 worker 時也用無狀態模式
+        os.environ["MCP_STATELESS_HTTP"] = "1"
+        serve("bench_search_workers:create_app", "http", "127.0.0.1",
+              int(sys.argv[3]), int(sys.argv[2]), search_rate=1e6,
+              log_level="warning")
+    else:
+        main()
@@ -0,0 +1,152 @@
+"""以本機的假 Spotify API 測試 server_spotify 的執行緒池與請求合併
+
+用法：uv run bench_spotify.py [並行數]
+
+啟動假的 Spotify Web API，以 SPOTIFY_API_PREFIX 與
+SPOTIFY_ACCESS_TOKEN 讓 server_spotify 改連到假服務，不必走 OAuth。
+每個假 API 請求花費 API_DELAY 秒，並記錄收到的請求數與同時進行的
+最大請求數，檢查：
+- 同時查詢正在播放的音樂，只送出一次 API 請求
+- 同時搜尋 4 個關鍵字（重複的搜尋大小寫與空白不同，視為相同），
+  只送出 4 次 API 請求
+- 播放控制不合併，同時進行的 API 請求不超過 MAX_SPOTIFY_WORKERS，
+  並與原本直接在 async 工具中呼叫 spotipy 的耗時比較
+任何一項不符合時以非 0 的結束碼結束。
+"""
+import asyncio
+import os
+import sys
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from bench_util import free_port, start_stub
+
+PORT = free_port()
+# server_spotify 匯入時讀取這兩個環境變數
+os.environ["SPOTIFY_API_PREFIX"] = f"http://127.0.0.1:{PORT}/v1"
+os.environ["SPOTIFY_ACCESS_TOKEN"] = "fake"
+
+import server_spotify
+
+API_DELAY = 0.2 # 假 API 每個請求的秒數
+QUERIES = ["Jay Chou", "Taylor Swift", "Adele", "Coldplay"]
+# 重複的搜尋改變大小寫與空白，正規化後仍是同一個搜尋
+VARIANTS = [str, str.upper, lambda query: f"  {query.lower()} "]
+
+TRACK = {
+    "name": "Song",
+    "uri": "spotify:track:1",
+    "duration_ms": 200000,
+    "album": {"name": "Album", "id": "a1", "href": "https://api/a1",
+              "release_date": "2020-01-01"},
+    "artists": [{"name": "Artist", "id": "r1", "href": "https://api/r1",
+                 "uri": "spotify:artist:r1", "type": "artist",
+                 "external_urls": {"spotify": "https://open/r1"}}],
+}
+
+class StubState:
+    hits = {}     # 端點 -> 請求數
+    active = 0    # 目前同時進行的請求數
+    max_active = 0
+
+    @classmethod
+    def reset(cls):
+        cls.hits = {}
+        cls.max_active = 0
+
+async def handle(name, body):
+    StubState.hits[name] = StubState.hits.get(name, 0) + 1
+    StubState.active += 1
+    StubState.max_active = max(StubState.max_active, StubState.active)
+    try:
+        await asyncio.sleep(API_DELAY)
+    finally:
+        StubState.active -= 1
+    return body
+
+async def player(request):
+    return JSONResponse(await handle(
+        "current_playback", {"is_playing": True, "item": TRACK}
+    ))
+
+async def search(request):
+    return JSONResponse(await handle(
+        "search", {"tracks": {"items": [TRACK] * 3}}
+    ))
+
+async def play(request):
+    await handle("start_playback", None)
+    return Response(status_code=204)
+
+stub = Starlette(routes=[
+    Route("/v1/me/player", player),
+    Route("/v1/search", search),
+    Route("/v1/me/player/play", play, methods=["PUT"]),
+])
+
+failed = False
+
+def check(name, actual, expected):
+    global failed
+    ok = actual == expected
+    failed |= not ok
+    print(f"{'OK' if ok else 'FAIL':6}{name}：{actual}（預期 {expected}）")
+
+async def gather_timed(calls):
+    start = time.perf_counter()
+    await asyncio.gather(*calls)
+    return time.perf_counter() - start
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    workers = server_spotify.MAX_SPOTIFY_WORKERS
+    print(f"並行數 {concurrency}，執行緒池 {workers} 個執行緒，"
+          f"假 API 每個請求 {API_DELAY} 秒")
+
+    StubState.reset()
+    await gather_timed([server_spotify.spotify_now_playing()
+                        for _ in range(concurrency)])
+    check("同時查詢正在播放的音樂的 API 請求數",
+          StubState.hits.get("current_playback"), 1)
+
+    StubState.reset()
+    server_spotify.search_cache.clear()
+    await gather_timed([
+        server_spotify.spotify_search(
+            VARIANTS[i // len(QUERIES) % len(VARIANTS)](QUERIES[i % len(QUERIES)])
+        ) for i in range(concurrency)
+    ])
+    check(f"同時搜尋 {len(QUERIES)} 個關鍵字的 API 請求數",
+          StubState.hits.get("search"), min(len(QUERIES), concurrency))
+
+    StubState.reset()
+    elapsed = await gather_timed([
+        server_spotify.spotify_play("spotify:track:1", "d1")
+        for _ in range(concurrency)
+    ])
+    check("播放控制的 API 請求數", StubState.hits.get("start_playback"),
+          concurrency)
+    check("同時進行的最大 API 請求數", StubState.max_active,
+          min(workers, concurrency))
+    print(f"{'':6}執行緒池：{elapsed:.2f} 秒")
+
+    # 原本的作法：在 async 工具中直接呼叫同步的 spotipy，一次只能進行一個
+    async def legacy_play():
+        server_spotify.sp.start_playback(device_id="d1",
+                                         uris=["spotify:track:1"])
+    StubState.reset()
+    elapsed = await gather_timed([legacy_play() for _ in range(concurrency)])
+    print(f"{'':6}原本直接呼叫：{elapsed:.2f} 秒，"
+          f"同時進行的最大 API 請求數 {StubState.max_active}")
+
+if __name__ == "__main__":
+    server, _ = start_stub(stub, PORT)
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
+        server_spotify.executor.shutdown()
+    sys.exit(1 if failed else 0)
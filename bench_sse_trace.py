@@ -0,0 +1,134 @@
+"""比較 server_sse_add.py 在不同追蹤設定下的 SSE 工具呼叫吞吐量
+
+用法：uv run bench_sse_trace.py [秒數] [session 數] [每個 session 的並行數]
+
+每種設定各啟動一次伺服器，以多個 SSE session 持續呼叫 add 指定的秒數：
+- pprint：原本在工具中以 rich 的 pprint 印出 Context 的作法
+- off：追蹤關閉（預設）
+- summary 10%：取樣 10% 寫入檔案
+- detail 100%：每次呼叫都記錄完整資訊並寫入檔案
+- detail 環狀緩衝：每次呼叫都記錄完整資訊，保留在記憶體中
+伺服器的標準輸出導向 /dev/null，pprint 仍需要完整排版。
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+from bench_util import free_port, latency_ms, stop_process, wait_for_port
+
+MODES = [
+    ("pprint", {}),
+    ("off", {"MCP_TRACE": "off"}),
+    ("summary 10%", {"MCP_TRACE": "summary", "MCP_TRACE_SAMPLE": "0.1"}),
+    ("detail 100%", {"MCP_TRACE": "detail", "MCP_TRACE_SAMPLE": "1"}),
+    ("detail 環狀緩衝", {"MCP_TRACE": "detail", "MCP_TRACE_SAMPLE": "1"}),
+]
+
+def serve(mode, port):
+    """在子行程中執行伺服器"""
+    import uvicorn
+
+    if mode == "pprint":
+        from mcp.server.fastmcp import FastMCP, Context
+        from rich.pretty import pprint
+
+        mcp = FastMCP("My SSE Server")
+
+        @mcp.tool()
+        def add(a: int, b: int, ctx: Context) -> int:
+            """Add two numbers"""
+            pprint(ctx.client_id)
+            pprint(ctx.request_id)
+            pprint(ctx.request_context)
+            pprint(ctx.session.client_params)
+            return a + b
+    else:
+        from server_sse_add import mcp
+
+    uvicorn.run(mcp.sse_app(), host="127.0.0.1", port=port,
+                log_level="warning")
+
+async def load(url, sessions, concurrency, duration):
+    """以多個 session 持續呼叫 add，傳回 (成功延遲串列, 失敗數)"""
+    latencies = []
+    failures = 0
+    deadline = time.monotonic() + duration
+
+    async def client():
+        async with sse_client(url) as streams:
+            async with ClientSession(*streams) as session:
+                await session.initialize()
+
+                async def worker():
+                    nonlocal failures
+                    i = 0
+                    while time.monotonic() < deadline:
+                        i += 1
+                        start = time.perf_counter()
+                        try:
+                            result = await session.call_tool(
+                                "add", {"a": i, "b": 1}
+                            )
+                            if result.isError:
+                                raise RuntimeError(result.content)
+                        except Exception:
+                            failures += 1
+                            continue
+                        latencies.append(time.perf_counter() - start)
+
+                await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    await asyncio.gather(*[client() for _ in range(sessions)])
+    return latencies, failures
+
+def bench(name, env, duration, sessions, concurrency, trace_dir):
+    port = free_port()
+    trace_file = None
+    env = {**os.environ, **env, "FASTMCP_LOG_LEVEL": "WARNING"}
+    if env.get("MCP_TRACE") and "環狀" not in name:
+        trace_file = os.path.join(trace_dir, f"{port}.jsonl")
+        env["MCP_TRACE_FILE"] = trace_file
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", name, str(port)],
+        env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        latencies, failures = asyncio.run(load(
+            f"http://127.0.0.1:{port}/sse", sessions, concurrency, duration
+        ))
+    finally:
+        stop_process(server)
+
+    traced = "-"
+    if trace_file is not None and os.path.exists(trace_file):
+        with open(trace_file, encoding="utf-8") as f:
+            traced = sum(1 for _ in f)
+    done = len(latencies)
+    p50, p99 = latency_ms(latencies)
+    print(f"{name:16}{done:8}{failures:6}{done / duration:10.1f}"
+          f"{p50:9.1f}{p99:9.1f}{traced:>8}", flush=True)
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    print(f"每種設定 {duration:g} 秒，{sessions} 個 session，"
+          f"每個 session 並行 {concurrency} 個呼叫")
+    print(f"{'':16}{'完成':>6}{'失敗':>4}{'呼叫/秒':>7}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'寫入紀錄':>4}", flush=True)
+    with tempfile.TemporaryDirectory() as trace_dir:
+        for name, env in MODES:
+            bench(name, env, duration, sessions, concurrency, trace_dir)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
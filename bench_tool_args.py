@@ -0,0 +1,74 @@
+"""比較工具參數解碼方式的速度
+
+用法：uv run bench_tool_args.py [重複次數]
+
+比較原本的 eval()、json.loads()、orjson.loads()（有安裝時）以及
+tool_args.decode_arguments()（有安裝 jsonschema 或 fastjsonschema 時
+包含驗證；兩者都有安裝時另外列出只用 jsonschema 驗證的結果）。
+"""
+import json
+import sys
+import timeit
+
+import tool_args
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "latitude": {"type": "number"},
+        "longitude": {"type": "number"},
+        "keyword": {"type": "string"},
+        "num_results": {"type": "integer"},
+    },
+    "required": ["latitude", "longitude"],
+}
+
+SAMPLES = {
+    "small": '{"latitude": 25.03, "longitude": 121.56}',
+    "medium": json.dumps({
+        "latitude": 25.03,
+        "longitude": 121.56,
+        "keyword": "台北 天氣 " * 20,
+        "num_results": 10,
+    }, ensure_ascii=False),
+    "literals": '{"latitude": 25.03, "longitude": 121.56, "flag": true, "x": null}',
+}
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    decoders = {"eval": eval, "json.loads": json.loads}
+    if tool_args.orjson is not None:
+        decoders["orjson.loads"] = tool_args.orjson.loads
+    decoders["decode_arguments"] = (
+        lambda text: tool_args.decode_arguments("bench", text)
+    )
+    if tool_args.SCHEMA_ERRORS:
+        decoders["decode_arguments+schema"] = (
+            lambda text: tool_args.decode_arguments("bench", text, SCHEMA)
+        )
+    if (tool_args.validator_for is not None
+            and tool_args.fastjsonschema is not None):
+        # 不使用編譯好的函式，只以 jsonschema 驗證
+        validator = tool_args.SchemaValidator(SCHEMA)
+        validator.compiled = None
+        tool_args._validators["jsonschema"] = (SCHEMA, validator)
+        decoders["decode_arguments+jsonschema"] = (
+            lambda text: tool_args.decode_arguments("jsonschema", text, SCHEMA)
+        )
+
+    print(f"每種方式執行 {number} 次，單位為每次呼叫的微秒數")
+    print(f"{'':28}" + "".join(f"{name:>12}" for name in SAMPLES))
+    for name, decode in decoders.items():
+        row = f"{name:28}"
+        for text in SAMPLES.values():
+            try:
+                decode(text)
+            except Exception:
+                row += f"{'失敗':>10}"
+                continue
+            seconds = timeit.timeit(lambda: decode(text), number=number)
+            row += f"{seconds / number * 1e6:12.2f}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""bench_*.py 共用的工具
+
+- free_port()：取得本機可用的連接埠
+- start_stub()：在背景執行緒中以 uvicorn 啟動假服務
+- wait_for_port()：等待子行程中的伺服器開始接受連線
+- stop_process()：結束子行程中的伺服器
+- latency_ms()：計算延遲的 p50 與 p99
+"""
+import socket
+import statistics
+import subprocess
+import threading
+import time
+
+import uvicorn
+
+HOST = "127.0.0.1"
+
+def free_port() -> int:
+    """取得本機可用的連接埠"""
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+def start_stub(app, port=None) -> tuple[uvicorn.Server, int]:
+    """在背景執行緒中啟動 ASGI app，開始接受連線後才返回
+
+    Args:
+        app: 假服務的 ASGI app
+        port: 連接埠，None 表示自動選擇
+
+    Returns:
+        (server, port)，結束時設定 server.should_exit = True
+    """
+    if port is None:
+        port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        app, host=HOST, port=port, log_level="warning"
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, port
+
+def wait_for_port(port, timeout=30):
+    """等待子行程中的伺服器開始接受連線"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex((HOST, port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"伺服器沒有在 {timeout} 秒內啟動")
+
+def stop_process(process, timeout=10):
+    """結束子行程，逾時仍未結束就強制結束"""
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def latency_ms(latencies) -> tuple[float, float]:
+    """傳回延遲（秒）的 p50 與 p99 毫秒數，沒有資料時都是 0"""
+    if not latencies:
+        return 0.0, 0.0
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return statistics.median(latencies) * 1000, p99 * 1000
@@ -0,0 +1,113 @@
+"""Benchmark NWS requests against a local stub server.
+
+Usage: uv run bench_weather.py [requests] [concurrency]
+
+Starts a stub of the NWS API on localhost and compares the old
+per-request httpx.AsyncClient with the shared keep-alive client in
+server_weather.py, reporting requests/sec and p50/p99 latency.
+
+The stub speaks plain HTTP on loopback, so the numbers only include the
+TCP handshake; against api.weather.gov every new client also pays a
+TLS handshake and the gap is considerably larger.
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from bench_util import free_port, latency_ms, start_stub
+
+PORT = free_port()
+BASE = f"http://127.0.0.1:{PORT}"
+# server_weather reads NWS_API_BASE at import time
+os.environ["NWS_API_BASE"] = BASE
+
+import server_weather
+
+# FastMCP turns on INFO logging, which would log every request here
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+PERIOD = {
+    "name": "Tonight",
+    "temperature": 61,
+    "temperatureUnit": "F",
+    "windSpeed": "5 to 10 mph",
+    "windDirection": "SW",
+    "detailedForecast": "Partly cloudy, with a low around 61. " * 3,
+}
+
+async def points(request):
+    return JSONResponse({"properties": {
+        "forecast": f"{BASE}/gridpoints/MTR/85,105/forecast"
+    }})
+
+async def forecast(request):
+    return JSONResponse({"properties": {"periods": [PERIOD] * 14}})
+
+async def alerts(request):
+    return JSONResponse({"features": []})
+
+stub = Starlette(routes=[
+    Route("/points/{coords}", points),
+    Route("/gridpoints/{office}/{grid}/forecast", forecast),
+    Route("/alerts/active/area/{state}", alerts),
+])
+
+async def request_per_client(url: str):
+    """The original make_nws_request: a new client for every call."""
+    headers = {
+        "User-Agent": server_weather.USER_AGENT,
+        "Accept": "application/geo+json"
+    }
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.get(url, headers=headers, timeout=30.0)
+            response.raise_for_status()
+            return response.json()
+        except Exception:
+            return None
+
+async def run(name, request, total, concurrency):
+    url = f"{BASE}/gridpoints/MTR/85,105/forecast"
+    latencies = []
+    failures = 0
+    queue = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for _ in queue:
+            start = time.perf_counter()
+            if await request(url) is None:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = latency_ms(latencies)
+    print(f"{name:24}{total / elapsed:10.1f}{p50:10.2f}{p99:10.2f}{failures:10}")
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f"{total} requests, concurrency {concurrency}, "
+          f"HTTP/2 {'on' if server_weather.HTTP2 else 'off (h2 not installed)'}")
+    print(f"{'':24}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'failed':>10}")
+    await run("client per request", request_per_client, total, concurrency)
+    await run("shared client", server_weather.make_nws_request,
+              total, concurrency)
+    await server_weather.get_http_client().aclose()
+
+if __name__ == "__main__":
+    server, _ = start_stub(stub, PORT)
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
@@ -0,0 +1,80 @@
+"""MCP 伺服器共用的結果快取與請求合併
+
+server_spotify 與 google_search 都把同步的 API 呼叫放到執行緒中執行，
+並需要：
+- TTLCache：有存活時間的 LRU 快取，超過存活時間或數量上限時
+  移除最舊的項目，並統計命中率
+- SingleFlight：相同鍵值的呼叫同時進行時只真的執行一次，
+  所有呼叫端共用同一個結果
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+import asyncio
+import time
+
+class TTLCache:
+    """有存活時間的 LRU 快取，並統計命中與未命中次數"""
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry[0]:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+class SingleFlight:
+    """相同鍵值的並行呼叫只執行一次，共用同一個結果"""
+    def __init__(self):
+        self._inflight: dict[Any, asyncio.Future] = {} # 進行中的呼叫
+
+    async def run(self, key, start: Callable[[], Awaitable],
+                  on_result: Callable[[Any], None] | None = None) -> Any:
+        """沒有相同鍵值的呼叫在進行時才呼叫 start() 開始執行
+
+        Args:
+            key: 呼叫的鍵值，必須可以雜湊
+            start: 開始執行並傳回 awaitable 的函式
+            on_result: 成功時以結果呼叫一次，例如放進快取
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(start())
+            self._inflight[key] = future
+
+            def done(future):
+                self._inflight.pop(key, None)
+                if (on_result is not None and not future.cancelled()
+                        and future.exception() is None):
+                    on_result(future.result())
+
+            future.add_done_callback(done)
+        # 某個呼叫端被取消時不要連帶取消其他呼叫端共用的呼叫
+        return await asyncio.shield(future)
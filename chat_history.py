@@ -0,0 +1,147 @@
+"""依 token 預算管理對話紀錄
+
+取代原本固定保留最後幾筆訊息的做法：
+- 每則訊息加入時計算一次 token 數，之後不必重算
+- 總 token 數超過預算時，從最舊的一輪對話開始移除
+- 以「輪」為單位移除，同一輪中的 function_call 與
+  function_call_output 一定會一起保留或一起移除
+- 可以指定 summarizer，把移除的對話摘要成一則訊息保留下來
+
+有安裝 tiktoken 時以 tiktoken 計算 token 數，否則以字元數估算。
+"""
+import json
+import sys
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MAX_HISTORY_TOKENS = 4000 # 預設的對話紀錄 token 預算
+MESSAGE_OVERHEAD = 4      # 每則訊息額外的格式 token 數
+
+_encoding = None
+if tiktoken is not None:
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+def message_text(message):
+    """取出訊息中用來計算 token 數的文字"""
+    if not isinstance(message, dict):
+        # Responses API 傳回的項目，例如 function_call
+        if hasattr(message, "model_dump_json"):
+            return message.model_dump_json(exclude_none=True)
+        return str(message)
+    content = message.get("content", message.get("output", ""))
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+def count_text_tokens(text):
+    """計算文字的 token 數"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # 估算：ASCII 字元約 4 個一個 token，其餘（例如中文）每字一個 token
+    ascii_count = sum(1 for ch in text if ch.isascii())
+    return (ascii_count + 3) // 4 + len(text) - ascii_count
+
+def count_tokens(message):
+    """計算單則訊息的 token 數"""
+    return count_text_tokens(message_text(message)) + MESSAGE_OVERHEAD
+
+class ChatHistory:
+    """限制 token 數的對話紀錄"""
+    def __init__(self, max_tokens=MAX_HISTORY_TOKENS, summarizer=None):
+        """
+        Args:
+            max_tokens: 對話紀錄的 token 預算
+            summarizer: 可選的 async 函式 summarizer(summary, messages)，
+                        傳入先前的摘要（或 None）與要移除的訊息，
+                        傳回新的摘要文字；未指定時直接移除舊對話
+        """
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.tokens = 0       # 目前的總 token 數
+        self._turns = []      # [(該輪的訊息串列, token 數)]
+        self._summary = None  # (摘要訊息, token 數, 摘要文字)
+        self._messages = None # 快取攤平後的訊息串列
+
+    @property
+    def messages(self):
+        """目前保留的所有訊息，有摘要時摘要放在最前面"""
+        if self._messages is None:
+            self._messages = []
+            if self._summary is not None:
+                self._messages.append(self._summary[0])
+            for messages, _ in self._turns:
+                self._messages += messages
+        return self._messages
+
+    async def add_turn(self, messages):
+        """加入一輪對話，超過預算時移除最舊的對話
+
+        Args:
+            messages: 這一輪的所有訊息，從使用者的提問開始
+        """
+        tokens = sum(count_tokens(message) for message in messages)
+        self._turns.append((list(messages), tokens))
+        self.tokens += tokens
+        self._messages = None
+        await self._trim()
+
+    def clear(self):
+        """清除所有對話紀錄"""
+        self.tokens = 0
+        self._turns = []
+        self._summary = None
+        self._messages = None
+
+    async def _trim(self):
+        """移除超過預算的舊對話，至少保留最新的一輪
+
+        有 summarizer 時把移除的對話併入摘要，加入摘要後仍超過預算時
+        繼續移除更多對話並重新摘要
+        """
+        while self.tokens > self.max_tokens and len(self._turns) > 1:
+            dropped = []
+            while self.tokens > self.max_tokens and len(self._turns) > 1:
+                messages, tokens = self._turns.pop(0)
+                self.tokens -= tokens
+                dropped += messages
+            if self.summarizer is not None:
+                await self._summarize(dropped)
+        if self._summary is not None and self.tokens > self.max_tokens:
+            # 只剩最新一輪仍超過預算，縮短摘要，連摘要都放不下時移除摘要
+            room = self.max_tokens - (self.tokens - self._summary[1])
+            summary = self._summary[2]
+            while summary and count_tokens(self._summary_message(summary)) > room:
+                summary = summary[:len(summary) * 3 // 4]
+            self._set_summary(summary or None)
+
+    async def _summarize(self, dropped):
+        """把移除的訊息併入摘要，摘要失敗時直接移除"""
+        previous = self._summary[2] if self._summary is not None else None
+        try:
+            summary = await self.summarizer(previous, dropped)
+        except Exception as e:
+            print(f"Warning: 無法摘要舊對話，直接移除：{e!r}", file=sys.stderr)
+            return
+        self._set_summary(summary)
+
+    @staticmethod
+    def _summary_message(summary):
+        return {
+            "role": "user",
+            "content": f"先前對話的摘要：\n{summary}"
+        }
+
+    def _set_summary(self, summary):
+        """換成新的摘要，None 表示移除摘要"""
+        if self._summary is not None:
+            self.tokens -= self._summary[1]
+            self._summary = None
+        if summary is not None:
+            message = self._summary_message(summary)
+            tokens = count_tokens(message)
+            self._summary = (message, tokens, summary)
+            self.tokens += tokens
+        self._messages = None
@@ -5,7 +5,10 @@ from contextlib import AsyncExitStack, suppress
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
-from anthropic import Anthropic
+import anthropic_loop
+import llm_clients
+from chat_history import ChatHistory
+from tool_cache import ToolCatalog, snapshot_key
 
 from rich.pretty import pprint
 import os, sys
@@ -13,12 +16,15 @@ import warnings
 
 warnings.filterwarnings("ignore", category=ResourceWarning)
 
+STREAM_OUTPUT = False # 是否以串流方式即時顯示回覆
+
 class MCPClient:
     def __init__(self):
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
+        self.tool_catalog: Optional[ToolCatalog] = None
         self.exit_stack = AsyncExitStack()
-        self.anthropic = Anthropic()
+        self.anthropic = llm_clients.get_async_anthropic()
     # methods will go here
 
     async def connect_to_server(self, server_script_path: str):
@@ -49,19 +55,29 @@ class MCPClient:
                 "SPOTIFY_CLIENT_SECRET": os.getenv("SPOTIFY_CLIENT_SECRET")
             }
 
+        # Tools are listed once and cached until the server
+        # sends notifications/tools/list_changed
+        self.tool_catalog = ToolCatalog(
+            key=snapshot_key(server_params.command, server_params.args)
+        )
+
         stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
         self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+        self.session = await self.exit_stack.enter_async_context(
+            ClientSession(self.stdio, self.write,
+                          message_handler=self.tool_catalog.handle_message)
+        )
+        self.tool_catalog.session = self.session
 
         await self.session.initialize()
 
         # List available tools
-        response = await self.session.list_tools()
-        tools = response.tools
+        tools = await self.tool_catalog.get()
         print("\nConnected to server with tools:", [tool.name for tool in tools])
         # pprint(tools)
 
-    async def process_query(self, query: str, hist: list) -> str:
+    async def process_query(self, query: str, hist: list,
+                            usage=None) -> str:
         """Process a query using llm and available tools"""
         messages = hist + [
             {
@@ -70,84 +86,42 @@ class MCPClient:
             }
         ]
 
-        response = await self.session.list_tools()
-        available_tools = [{
-            "name": tool.name,
-            "description": tool.description,
-            "input_schema": tool.inputSchema
-        } for tool in response.tools]
-
-        while True:
-            # Initial Claude API call
-            response = self.anthropic.messages.create(
-                # model="claude-3-5-sonnet-20241022",
-                model="claude-3-7-sonnet-20250219",
-                max_tokens=1000,
-                messages=messages,
-                tools=available_tools
-            )
-
-            # Process response and handle tool calls
-            tool_results = []
-            final_text = []
-
-            assistant_message_content = []
-            for content in response.content:
-                if content.type == 'text':
-                    # pprint(content)
-                    final_text.append(content.text)
-                    assistant_message_content.append(content)
-                elif content.type == 'tool_use':
-                    # pprint(content)
-                    tool_name = content.name
-                    tool_args = content.input
-
-                    # Execute tool call
-                    result = await self.session.call_tool(tool_name, tool_args)
-                    tool_results.append({"call": tool_name, "result": result})
-                    final_text.append(
-                        f"\n[Calling tool {tool_name} with args {tool_args}]\n\n"
-                        f"{result.content[0].text}\n\n"
-                    )
-
-                    assistant_message_content.append(content)
-                    messages.append({
-                        "role": "assistant",
-                        "content": assistant_message_content
-                    })
-                    messages.append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": content.id,
-                                "content": result.content
-                            }
-                        ]
-                    })
-
-            if tool_results == []:
-                break
-        return "\n".join(final_text)
+        tools = await self.tool_catalog.get()
+        return await anthropic_loop.run_agent(
+            self.anthropic, self.session, tools, messages,
+            # model="claude-3-5-sonnet-20241022",
+            model="claude-3-7-sonnet-20250219",
+            stream=STREAM_OUTPUT,
+            usage=usage
+        )
 
     async def chat_loop(self):
         """Run an interactive chat loop"""
         print("\nMCP Client Started!")
         print("Type your queries or 'quit' to exit.")
 
-        hist = []
+        # Keep history within a token budget, summarizing the oldest turns
+        hist = ChatHistory(summarizer=llm_clients.anthropic_summarizer())
         while True:
             try:
                 # pprint(hist)
-                query = input("\nQuery: ").strip()
+                # Wait for input in a worker thread so the event loop keeps running
+                query = (await asyncio.to_thread(input, "\nQuery: ")).strip()
 
                 if query.lower() == 'quit':
                     break
 
-                response = await self.process_query(query, hist)
-                print("\n" + response)
-                hist += [{"role": "user", "content": query}]
-                hist += [{"role": "assistant", "content": response}]
+                usage = llm_clients.TokenUsage()
+                response = await self.process_query(
+                    query, hist.messages, usage
+                )
+                if not STREAM_OUTPUT: # 串流時已經顯示過了
+                    print("\n" + response)
+                print(usage.report()) # 這一輪命中提示快取的 token 數
+                await hist.add_turn([
+                    {"role": "user", "content": query},
+                    {"role": "assistant", "content": response}
+                ])
 
             except Exception as e:
                 print(f"\nError: {str(e)}")
@@ -168,6 +142,7 @@ async def main():
     finally:
         print('離開程式')
     await client.cleanup()
+    await llm_clients.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
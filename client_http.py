@@ -2,51 +2,57 @@ import asyncio
 from typing import Optional
 from contextlib import AsyncExitStack
 
-from mcp import ClientSession
-from mcp.client.streamable_http import streamablehttp_client
-
-
-from anthropic import Anthropic
+import anthropic_loop
+import llm_clients
+from mcp_http import ResilientSession
+from tool_cache import ToolCatalog, snapshot_key
 from dotenv import load_dotenv
 
 load_dotenv()  # load environment variables from .env
 
+STREAM_OUTPUT = False # Print replies as they are generated
+CONNECT_TIMEOUT = 30  # Seconds allowed for the first connection
+
 class MCPClient:
     def __init__(self):
         # Initialize session and client objects
-        self.session: Optional[ClientSession] = None
+        self.session: Optional[ResilientSession] = None
+        self.tool_catalog: Optional[ToolCatalog] = None
         self.exit_stack = AsyncExitStack()
-        self.anthropic = Anthropic()
+        self.anthropic = llm_clients.get_async_anthropic()
 
     async def connect_to_sse_server(self, server_url: str):
-        """Connect to an MCP server running with SSE transport"""
-        # Store the context managers so they stay alive
-        self._streams_context = streamablehttp_client(
-            url=server_url,
+        """Connect to an MCP server running with streamable HTTP transport"""
+        # Tools are listed once and cached until the server
+        # sends notifications/tools/list_changed
+        self.tool_catalog = ToolCatalog(key=snapshot_key(server_url))
+        # Reconnects with backoff when the server goes away, resuming the
+        # old session when the server still knows it
+        self.session = ResilientSession(
+            server_url,
+            message_handler=self.tool_catalog.handle_message,
+            on_reconnect=self._on_reconnect
         )
-        streams = await self._streams_context.__aenter__()
-
-        self._session_context = ClientSession(*streams[:2])
-        self.session: ClientSession = await self._session_context.__aenter__()
-
-        # Initialize
-        await self.session.initialize()
+        await self.session.connect(timeout=CONNECT_TIMEOUT)
+        self.tool_catalog.session = self.session
 
         # List available tools to verify connection
-        print("Initialized SSE client...")
+        print("Initialized streamable HTTP client...")
         print("Listing tools...")
-        response = await self.session.list_tools()
-        tools = response.tools
+        tools = await self.tool_catalog.get()
         print("\nConnected to server with tools:", [tool.name for tool in tools])
 
+    def _on_reconnect(self, resumed: bool):
+        """A new session may come from a restarted server with other tools"""
+        if not resumed:
+            self.tool_catalog.invalidate()
+
     async def cleanup(self):
         """Properly clean up the session and streams"""
-        if self._session_context:
-            await self._session_context.__aexit__(None, None, None)
-        if self._streams_context:
-            await self._streams_context.__aexit__(None, None, None)
+        if self.session:
+            await self.session.close()
 
-    async def process_query(self, query: str) -> str:
+    async def process_query(self, query: str, usage=None) -> str:
         """Process a query using Claude and available tools"""
         messages = [
             {
@@ -55,60 +61,15 @@ class MCPClient:
             }
         ]
 
-        response = await self.session.list_tools()
-        available_tools = [{ 
-            "name": tool.name,
-            "description": tool.description,
-            "input_schema": tool.inputSchema
-        } for tool in response.tools]
-
-        # Initial Claude API call
-        response = self.anthropic.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1000,
-            messages=messages,
-            tools=available_tools
+        tools = await self.tool_catalog.get()
+        # All tool results of a reply go back in one turn and the tools
+        # stay available, so multi-step tool chains can finish
+        return await anthropic_loop.run_agent(
+            self.anthropic, self.session, tools, messages,
+            model="claude-3-5-sonnet-20241022", stream=STREAM_OUTPUT,
+            usage=usage
         )
 
-        # Process response and handle tool calls
-        tool_results = []
-        final_text = []
-
-        for content in response.content:
-            if content.type == 'text':
-                final_text.append(content.text)
-            elif content.type == 'tool_use':
-                tool_name = content.name
-                tool_args = content.input
-                
-                # Execute tool call
-                result = await self.session.call_tool(tool_name, tool_args)
-                tool_results.append({"call": tool_name, "result": result})
-                final_text.append(f"[Calling tool {tool_name} with args {tool_args}]")
-
-                # Continue conversation with tool results
-                if hasattr(content, 'text') and content.text:
-                    messages.append({
-                    "role": "assistant",
-                    "content": content.text
-                    })
-                messages.append({
-                    "role": "user", 
-                    "content": result.content
-                })
-
-                # Get next response from Claude
-                response = self.anthropic.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=1000,
-                    messages=messages,
-                )
-
-                final_text.append(response.content[0].text)
-
-        return "\n".join(final_text)
-    
-
     async def chat_loop(self):
         """Run an interactive chat loop"""
         print("\nMCP Client Started!")
@@ -116,13 +77,17 @@ class MCPClient:
         
         while True:
             try:
-                query = input("\nQuery: ").strip()
+                # Wait for input in a worker thread so the event loop keeps running
+                query = (await asyncio.to_thread(input, "\nQuery: ")).strip()
                 
                 if query.lower() == 'quit':
                     break
                     
-                response = await self.process_query(query)
-                print("\n" + response)
+                usage = llm_clients.TokenUsage()
+                response = await self.process_query(query, usage)
+                if not STREAM_OUTPUT: # Already printed while streaming
+                    print("\n" + response)
+                print(usage.report()) # Cached vs uncached input tokens
                     
             except Exception as e:
                 print(f"\nError: {str(e)}")
@@ -139,6 +104,7 @@ async def main():
         await client.chat_loop()
     finally:
         await client.cleanup()
+        await llm_clients.aclose() # 也會關閉 MCP 連線共用的連線池
 
 
 if __name__ == "__main__":
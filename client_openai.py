@@ -5,8 +5,10 @@ from contextlib import AsyncExitStack
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
-# from anthropic import Anthropic
-from openai import OpenAI
+import llm_clients
+from chat_history import ChatHistory
+from tool_cache import ToolCatalog, snapshot_key
+from tool_args import decode_arguments
 
 from rich.pretty import pprint
 import os
@@ -15,8 +17,9 @@ class MCPClient:
     def __init__(self):
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
+        self.tool_catalog: Optional[ToolCatalog] = None
         self.exit_stack = AsyncExitStack()
-        self.openai = OpenAI()
+        self.openai = llm_clients.get_async_openai()
 
     async def connect_to_server(self, server_script_path: str):
         """Connect to an MCP server
@@ -62,19 +65,29 @@ class MCPClient:
             env=env
         )
 
+        # 工具清單只在連線時取得一次，之後使用快取
+        # 伺服器通知工具清單變動時才重新取得
+        self.tool_catalog = ToolCatalog(
+            key=snapshot_key(server_params.command, server_params.args, path)
+        )
+
         stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
         self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+        self.session = await self.exit_stack.enter_async_context(
+            ClientSession(self.stdio, self.write,
+                          message_handler=self.tool_catalog.handle_message)
+        )
+        self.tool_catalog.session = self.session
 
         await self.session.initialize()
 
         # List available tools
-        response = await self.session.list_tools()
-        tools = response.tools
+        tools = await self.tool_catalog.get()
         print("\nConnected to server with tools:", [tool.name for tool in tools])
         # pprint(tools)
 
-    async def process_query(self, query: str, hist: list) -> str:
+    async def process_query(self, query: str, hist: list,
+                            usage=None) -> str:
         """Process a query using llm and available tools"""
         messages = hist + [
             {
@@ -83,23 +96,27 @@ class MCPClient:
             }
         ]
 
-        response = await self.session.list_tools()
+        tools = await self.tool_catalog.get()
+        # 依名稱排序，每次請求的工具清單都相同才能命中提示快取
         available_tools = [{
             "type": "function",
             "name": tool.name,
             "description": tool.description,
             "parameters": tool.inputSchema
-        } for tool in response.tools]
+        } for tool in sorted(tools, key=lambda tool: tool.name)]
+        schemas = {tool.name: tool.inputSchema for tool in tools}
 
         while True:
             # Initial Claude API call
-            response = self.openai.responses.create(
+            response = await self.openai.responses.create(
                 # model="claude-3-5-sonnet-20241022",
                 model="gpt-4o-mini",
                 # max_tokens=1000,
                 input=messages,
                 tools=available_tools
             )
+            if usage is not None:
+                usage.add(response.usage)
 
             # Process response and handle tool calls
             tool_results = []
@@ -113,14 +130,21 @@ class MCPClient:
                 elif output.type == 'function_call':
                     # pprint(output)
                     tool_name = output.name
-                    tool_args = eval(output.arguments)
+                    tool_args, error = decode_arguments(
+                        tool_name, output.arguments, schemas.get(tool_name)
+                    )
 
-                    # Execute tool call
-                    result = await self.session.call_tool(tool_name, tool_args)
-                    tool_results.append({"call": tool_name, "result": result})
+                    if error is None:
+                        # Execute tool call
+                        result = await self.session.call_tool(tool_name, tool_args)
+                        text = result.content[0].text
+                    else:
+                        # 參數有誤時把錯誤訊息交給模型修正
+                        text = error
+                    tool_results.append({"call": tool_name, "result": text})
                     final_text.append(
-                        f"\n[Calling tool {tool_name} with args {tool_args}]\n\n"
-                        f"{result.content[0].text}\n\n"
+                        f"\n[Calling tool {tool_name} with args {output.arguments}]\n\n"
+                        f"{text}\n\n"
                     )
 
                     assistant_message_content.append(output)
@@ -129,7 +153,7 @@ class MCPClient:
                         # 建立可傳回函式執行結果的字典
                         "type": "function_call_output", # 以工具角色送出回覆
                         "call_id": output.call_id, # 叫用函式的識別碼
-                        "output": result.content[0].text # 函式傳回值
+                        "output": text # 函式傳回值
                     })
             if tool_results == []:
                 break
@@ -140,19 +164,27 @@ class MCPClient:
         print("\nMCP Client Started!")
         print("Type your queries or 'quit' to exit.")
 
-        hist = []
+        # Keep history within a token budget, summarizing the oldest turns
+        hist = ChatHistory(summarizer=llm_clients.openai_summarizer())
         while True:
             try:
-                pprint(hist)
-                query = input("\nQuery: ").strip()
+                pprint(hist.messages)
+                # Wait for input in a worker thread so the event loop keeps running
+                query = (await asyncio.to_thread(input, "\nQuery: ")).strip()
 
                 if query.lower() == 'quit':
                     break
 
-                response = await self.process_query(query, hist)
+                usage = llm_clients.TokenUsage()
+                response = await self.process_query(
+                    query, hist.messages, usage
+                )
                 print("\n" + response)
-                hist += [{"role": "user", "content": query}]
-                hist += [{"role": "assistant", "content": response}]
+                print(usage.report()) # 這一輪命中提示快取的 token 數
+                await hist.add_turn([
+                    {"role": "user", "content": query},
+                    {"role": "assistant", "content": response}
+                ])
 
             except Exception as e:
                 print(f"\nError: {str(e)}")
@@ -172,6 +204,7 @@ async def main():
         await client.chat_loop()
     finally:
         await client.cleanup()
+        await llm_clients.aclose()
 
 if __name__ == "__main__":
     import sys
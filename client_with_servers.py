@@ -1,20 +1,45 @@
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
-from contextlib import AsyncExitStack
-from openai import OpenAI
+from contextlib import AsyncExitStack, suppress
+from tool_router import ToolRouter
+from tool_args import decode_arguments, error_output
+from chat_history import ChatHistory
+import llm_clients
+from openai import BadRequestError, NotFoundError
 import asyncio
 import json
+import time
 import sys
 import os
 
-openai = OpenAI()
+openai = llm_clients.get_async_openai()
+# MODEL = "gpt-4.1-mini"
+MODEL = "gpt-4.1"
+
+CONNECT_TIMEOUT = 30 # 單一伺服器的連線逾時秒數，None 表示不限時
+KEEP_GOING = True    # 部分伺服器連線失敗時是否仍使用其餘的伺服器
+PARALLEL_TOOL_CALLS = True # 同一輪回覆中的多個工具呼叫是否同時執行
+MAX_CALLS_PER_SERVER = 4   # 單一伺服器同時執行的工具呼叫數量上限
+# 以串流方式即時顯示模型回覆，函式呼叫的參數一完整就開始執行工具
+STREAM_OUTPUT = False
+# 以 previous_response_id 串接回覆，工具執行後只送出新的執行結果，
+# 不必每次都重送完整對話；伺服器無法串接時會自動改回完整傳送
+CHAIN_RESPONSES = False
 
 class MCPClient:
     def __init__(self):
+        self.name = None
         self.session = None
         self.exit_stack = AsyncExitStack()
         self.tools = []
         self.tool_names = []
+        self.schemas = {}
+        self.on_tools_changed = None # 工具清單變動時呼叫的函式
+        self._refresh_task = None
+        self._task = None    # 負責持有連線的背景 task
+        self._closing = None # 通知背景 task 關閉連線的事件
+        # 限制同時送往這個伺服器的工具呼叫數量
+        self.semaphore = asyncio.Semaphore(MAX_CALLS_PER_SERVER)
 
     async def connect_to_server(self, server_info):
         """連接 MCP 伺服器
@@ -23,6 +48,7 @@ class MCPClient:
             server_info: MCP 伺服器的連接資訊
         """
 
+        self.name = server_info[0]
         server_params = StdioServerParameters(**server_info[1])
 
         stdio_transport = await (
@@ -33,13 +59,26 @@ class MCPClient:
         self.stdio, self.write = stdio_transport
         self.session = await (
             self.exit_stack.enter_async_context(
-                ClientSession(self.stdio, self.write)
+                ClientSession(
+                    self.stdio, self.write,
+                    logging_callback=self._handle_log,
+                    message_handler=self._handle_message
+                )
             )
         )
 
         await self.session.initialize()
+        await self.refresh_tools()
+
+        print('-' * 20)
+        print(f"已連接 {server_info[0]} 伺服器")
+        print('\n'.join(
+            [f'    - {name}' for name in self.tool_names]
+        ))
+        print('-' * 20)
 
-        # 取得 MCP 伺服器提供的工具資訊
+    async def refresh_tools(self):
+        """取得 MCP 伺服器提供的工具資訊"""
         response = await self.session.list_tools()
         tools = response.tools
         self.tools = [{
@@ -49,96 +88,384 @@ class MCPClient:
             "parameters": tool.inputSchema
         } for tool in tools]
         self.tool_names = [tool.name for tool in tools]
-        
-        print('-' * 20)
-        print(f"已連接 {server_info[0]} 伺服器")
-        print('\n'.join(
-            [f'    - {name}' for name in self.tool_names]
-        ))
-        print('-' * 20)
+        self.schemas = {tool.name: tool.inputSchema for tool in tools}
+        if self.on_tools_changed is not None:
+            self.on_tools_changed(self)
+
+    async def _handle_message(self, message):
+        """伺服器通知工具清單變動時重新取得工具資訊"""
+        if (isinstance(message, types.ServerNotification) and
+            isinstance(message.root, types.ToolListChangedNotification)):
+            # 這裡處理完之前收不到 list_tools() 的回應，
+            # 所以改在另一個 task 中重新取得
+            self._refresh_task = asyncio.create_task(self.refresh_tools())
+
+    async def _handle_log(self, params):
+        """即時顯示工具執行中送出的 log 通知
+
+        例如 server_shell_helper 開啟 STREAM_OUTPUT 時，指令的輸出會
+        以 logger 為 stdout 或 stderr 的 log 通知陸續送來，
+        不必等指令結束才看到輸出
+        """
+        text = params.data if isinstance(params.data, str) else repr(
+            params.data
+        )
+        if params.logger in ("stdout", "stderr"):
+            # 指令輸出的片段，原樣接續顯示
+            file = sys.stderr if params.logger == "stderr" else sys.stdout
+            print(text, end='', file=file, flush=True)
+        else:
+            print(f"[{self.name}] {params.level}: {text}", flush=True)
+
+    async def call_tool(self, tool_name, tool_args):
+        """使用 MCP 伺服器提供的工具，同時執行的數量受 semaphore 限制"""
+        async with self.semaphore:
+            return await self.session.call_tool(tool_name, tool_args)
+
+    async def start(self, server_info, timeout=None):
+        """在背景 task 中連接 MCP 伺服器，連線完成後才返回
+
+        stdio_client 內部使用 anyio 的 task group，必須在同一個
+        task 中進入與離開，因此每個伺服器的連線都交由自己的 task
+        開啟與關閉，才能同時連接多個伺服器。
+
+        Args:
+            server_info: MCP 伺服器的連接資訊
+            timeout: 連線逾時秒數，None 表示不限時
+        """
+        ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._serve(server_info, ready))
+        try:
+            await asyncio.wait_for(asyncio.shield(ready), timeout)
+        except BaseException:
+            # 逾時或失敗都要結束背景 task，避免留下子行程
+            self._task.cancel()
+            with suppress(BaseException):
+                await self._task
+            raise
+
+    async def _serve(self, server_info, ready):
+        """連接伺服器並持有連線，直到 cleanup() 要求關閉"""
+        try:
+            await self.connect_to_server(server_info)
+            ready.set_result(self)
+            await self._closing.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            await self.exit_stack.aclose()
 
     async def cleanup(self):
         """釋放資源"""
-        await self.exit_stack.aclose()
+        if self._task is None:
+            await self.exit_stack.aclose()
+            return
+        self._closing.set()
+        await self._task
+
+def chain_rejected(error):
+    """錯誤是否是因為無法串接前一個回覆
+
+    只有前一個回覆不存在或伺服器不接受 previous_response_id 時才改回
+    傳送完整對話；其他錯誤（例如對話太長、工具定義有誤）改傳完整對話
+    也一樣會失敗，不應該因此關閉串接模式。
+    """
+    return (error.param == "previous_response_id" or
+            error.code == "previous_response_not_found")
+
+def find_tool_call(router, output):
+    """找出提供工具的 MCPClient 並解析參數
 
-async def get_reply_text(clients, query, hist):
-    """單次問答"""
+    Returns:
+        (output, client, tool_name, tool_args, error)，tool_name 是
+        伺服器端的工具名稱；找不到工具或參數有誤時 error 是要交給
+        模型的錯誤訊息
+    """
+    route = router.resolve(output.name)
+    if route is None:
+        print(f"找不到 {output.name} 工具")
+        print('-' * 20)
+        error = error_output(
+            f"Unknown tool: {output.name}", code="unknown_tool"
+        )
+        return output, None, output.name, None, error
+    client, tool_name = route
+    tool_args, error = decode_arguments(
+        router.alias(client, tool_name),
+        output.arguments,
+        client.schemas.get(tool_name)
+    )
+    if error is None:
+        print(f"準備使用 {output.name}(**{tool_args})")
+    else:
+        print(f"{output.name} 的參數有誤：{output.arguments}")
+    print('-' * 20)
+    return output, client, tool_name, tool_args, error
+
+async def run_tool_call(output, client, tool_name, tool_args, error):
+    """執行單一工具呼叫，傳回要交給模型的文字
+
+    找不到工具或參數有誤時不呼叫工具，直接把錯誤訊息交給模型；
+    工具執行失敗時也不丟出例外，而是把錯誤訊息交給模型，同時執行的
+    其他工具呼叫不受影響，每個 call_id 都有對應的結果
+    """
+    if error is not None:
+        return error
+    try:
+        result = await client.call_tool(tool_name, tool_args)
+        return result.content[0].text
+    except Exception as e:
+        return error_output(
+            f"Tool {tool_name} failed: {e!r}", code="tool_error"
+        )
+
+def print_tool_result(text):
+    """顯示工具執行結果"""
+    print(text)
+    print('-' * 20)
+
+async def create_response(router, messages, new_items, previous_id,
+                          **kwargs):
+    """使用 Responses API 請 LLM 生成回覆
+
+    串接模式下若有前一個回覆的 id，就以 previous_response_id 接續，
+    只送出新的 function_call_output 項目；伺服器無法串接時改回
+    傳送完整的 messages，之後也不再嘗試串接，其他錯誤則直接丟出。
+
+    Args:
+        router: 工具路由表
+        messages: 完整的對話內容
+        new_items: 前一個回覆之後新增的項目
+        previous_id: 前一個回覆的 id，None 表示這是第一次請求
+        kwargs: 其他傳給 responses.create 的參數，例如 stream
+    """
+    global CHAIN_RESPONSES
+    if CHAIN_RESPONSES and previous_id is not None:
+        try:
+            return await openai.responses.create(
+                model=MODEL,
+                previous_response_id=previous_id,
+                input=new_items,
+                tools=router.tools,
+                store=True, # 必須儲存才能被後續的請求串接
+                **kwargs
+            )
+        except (BadRequestError, NotFoundError) as e:
+            if not chain_rejected(e):
+                raise
+            print(
+                f"無法串接前一個回覆，改為傳送完整對話：{e}",
+                file=sys.stderr
+            )
+            CHAIN_RESPONSES = False
+    return await openai.responses.create(
+        model=MODEL,
+        input=messages,
+        tools=router.tools,
+        store=CHAIN_RESPONSES, # 不串接時不儲存對話紀錄
+        **kwargs
+    )
+
+async def stream_reply(router, stream, usage=None):
+    """以串流方式取得 LLM 的回覆
+
+    文字一邊產生一邊顯示，每個函式呼叫的參數一完整就立刻開始
+    執行工具，不必等整個回覆結束。
+
+    Args:
+        router: 工具路由表
+        stream: responses.create 傳回的串流
+        usage: 可選的 TokenUsage，累計這次回覆的 token 數
+
+    Returns:
+        (response_id, final_text, tool_calls, tasks)，tasks 是與
+        tool_calls 順序相同、已開始執行的工具呼叫
+    """
+    async def call_tool(*tool_call):
+        text = await run_tool_call(*tool_call)
+        print_tool_result(text) # 完成就先顯示，不必等其他工具
+        return text
+
+    response_id = None
+    final_text = []
+    tool_calls = []
+    tasks = []
+    try:
+        async for event in stream:
+            if event.type == 'response.created':
+                response_id = event.response.id
+            elif event.type == 'response.completed':
+                if usage is not None:
+                    usage.add(event.response.usage)
+            elif event.type == 'response.output_text.delta':
+                print(event.delta, end='', flush=True)
+            elif event.type == 'response.output_item.done':
+                output = event.item
+                if output.type == 'message': # 一般訊息
+                    print()
+                    final_text.append(output.content[0].text)
+                elif output.type == 'function_call': # 使用工具
+                    tool_call = find_tool_call(router, output)
+                    tool_calls.append(tool_call)
+                    tasks.append(asyncio.create_task(call_tool(*tool_call)))
+    except BaseException:
+        # 串流中斷時取消已經開始的工具呼叫
+        for task in tasks:
+            task.cancel()
+        raise
+    return response_id, final_text, tool_calls, tasks
+
+async def get_reply_text(router, query, hist, usage=None):
+    """單次問答
+
+    Args:
+        router: 工具路由表
+        query: 使用者的提問
+        hist: 先前的對話紀錄
+        usage: 可選的 TokenUsage，累計這一輪所有呼叫的 token 數
+    """
     
     # 自行處理對話記錄
     messages = hist + [{"role": "user", "content": query}]
-    # 把 clients 中個別項目的 tools 串接在一起
-    tools = []
-    for client in clients:
-        tools += client.tools
+    previous_id = None # 前一個回覆的 id，串接模式使用
+    new_items = []     # 前一個回覆之後新增的項目，串接模式使用
 
     while True:
-        # 使用 Responses API 請 LLM 生成回覆
-        response = openai.responses.create(
-            # model="gpt-4.1-mini",
-            model="gpt-4.1",
-            input=messages,
-            tools=tools,
-            store=False # 不儲存對話紀錄
-        )
+        if STREAM_OUTPUT:
+            stream = await create_response(
+                router, messages, new_items, previous_id, stream=True
+            )
+            previous_id, final_text, tool_calls, tasks = await stream_reply(
+                router, stream, usage
+            )
+            if tool_calls == []:
+                break
+            # 工具已在串流過程中開始執行，這裡只等待全部完成
+            results = await asyncio.gather(*tasks)
+        else:
+            # 使用 Responses API 請 LLM 生成回覆
+            response = await create_response(
+                router, messages, new_items, previous_id
+            )
+            previous_id = response.id
+            if usage is not None:
+                usage.add(response.usage)
 
-        # Process response and handle tool calls
-        tool_results = []
-        final_text = []
-
-        for output in response.output:
-            if output.type == 'message': # 一般訊息
-                final_text.append(output.content[0].text)
-            elif output.type == 'function_call': # 使用工具
-                tool_name = output.name
-                tool_args = eval(output.arguments)
-                for client in clients:
-                    if tool_name in client.tool_names:
-                        break
-                else:
-                    # 如果沒有找到對應的工具，則跳過這個迴圈
-                    continue
-                print(f"準備使用 {tool_name}(**{tool_args})")
-                print('-' * 20)
-                # 使用 MCP 伺服器提供的工具
-                result = await client.session.call_tool(
-                    tool_name, tool_args
-                )
-                tool_results.append(
-                    {"call": tool_name, "result": result}
-                )
-                print(f"{result.content[0].text}")
-                print('-' * 20)
-
-                messages.append(output)
-                messages.append({
-                    # 建立可傳回函式執行結果的字典
-                    "type": "function_call_output", # 設為工具輸出類型的訊息
-                    "call_id": output.call_id, # 叫用函式的識別碼
-                    "output": result.content[0].text # 函式傳回值
-                })
-        if tool_results == []:
-            break
+            # Process response and handle tool calls
+            tool_calls = []
+            final_text = []
+
+            for output in response.output:
+                if output.type == 'message': # 一般訊息
+                    final_text.append(output.content[0].text)
+                elif output.type == 'function_call': # 使用工具
+                    tool_calls.append(find_tool_call(router, output))
+            if tool_calls == []:
+                break
+
+            # 使用 MCP 伺服器提供的工具
+            if PARALLEL_TOOL_CALLS:
+                # 同時執行所有工具呼叫，gather 會依呼叫順序傳回結果
+                results = await asyncio.gather(*[
+                    run_tool_call(*tool_call) for tool_call in tool_calls
+                ])
+            else:
+                results = [
+                    await run_tool_call(*tool_call) for tool_call in tool_calls
+                ]
+            for result in results:
+                print_tool_result(result)
+
+        new_items = []
+        for (output, *_), result in zip(tool_calls, results):
+            new_items.append({
+                # 建立可傳回函式執行結果的字典
+                "type": "function_call_output", # 設為工具輸出類型的訊息
+                "call_id": output.call_id, # 叫用函式的識別碼
+                "output": result # 函式傳回值
+            })
+            messages.append(output)
+            messages.append(new_items[-1])
     return "\n".join(final_text)
 
-async def chat_loop(clients):
+async def connect_all(server_infos,
+                      timeout=CONNECT_TIMEOUT,
+                      keep_going=KEEP_GOING):
+    """同時連接所有 MCP 伺服器，並顯示個別伺服器的連線時間
+
+    Args:
+        server_infos: 所有 MCP 伺服器的連接資訊
+        timeout: 單一伺服器的連線逾時秒數，None 表示不限時
+        keep_going: 部分伺服器連線失敗時是否仍使用其餘的伺服器
+
+    Returns:
+        連線成功的 MCPClient 串列，順序與 server_infos 相同；
+        若不允許部分失敗而有伺服器連線失敗，則傳回空串列
+    """
+    async def connect(server_info):
+        client = MCPClient()
+        start = time.perf_counter()
+        try:
+            await client.start(server_info, timeout)
+        except Exception as e:
+            return client, time.perf_counter() - start, e
+        return client, time.perf_counter() - start, None
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[connect(server_info) for server_info in server_infos]
+    )
+
+    clients = []
+    failed = False
+    for server_info, (client, elapsed, error) in zip(server_infos, results):
+        if error is None:
+            print(f"{server_info[0]} 連線耗時 {elapsed:.2f} 秒")
+            clients.append(client)
+        else:
+            if isinstance(error, TimeoutError):
+                error = f"超過 {timeout} 秒未完成連線"
+            print(
+                f"Error: {server_info[0]} 連線失敗 "
+                f"({elapsed:.2f} 秒): {error}",
+                file=sys.stderr
+            )
+            failed = True
+    print(f"全部伺服器連線耗時 {time.perf_counter() - start:.2f} 秒")
+
+    if failed and not keep_going:
+        for client in clients[::-1]:
+            await client.cleanup()
+        return []
+    return clients
+
+async def chat_loop(router):
     """聊天迴圈"""
     print("直接按 ↵ 可結束對話")
 
-    hist = []
+    # 依 token 預算保留對話紀錄，超過預算時把最舊的對話摘要成一則訊息
+    hist = ChatHistory(summarizer=llm_clients.openai_summarizer())
     while True:
         try:
-            query = input(">>> ").strip()
+            # 在另一個執行緒等待輸入，避免卡住 event loop
+            query = (await asyncio.to_thread(input, ">>> ")).strip()
 
             if query == '':
                 break
 
+            usage = llm_clients.TokenUsage()
             reply = await get_reply_text(
-                clients, query, hist
+                router, query, hist.messages, usage
             )
-            print(reply)
-            hist += [{"role": "user", "content": query}]
-            hist += [{"role": "assistant", "content": reply}]
-            hist = hist[-6:] # 只保留最近的 10 筆對話紀錄
+            if not STREAM_OUTPUT: # 串流模式已經即時顯示過回覆
+                print(reply)
+            print(usage.report()) # 這一輪命中提示快取的 token 數
+            await hist.add_turn([
+                {"role": "user", "content": query},
+                {"role": "assistant", "content": reply}
+            ])
 
         except Exception as e:
             print(f"\nError: {str(e)}")
@@ -168,17 +495,23 @@ async def main():
         )
         return
     
-    clients = []
+    clients = await connect_all(server_infos)
+    if len(clients) == 0:
+        print("Error: 沒有可用的 MCP 伺服器", file=sys.stderr)
+        return
+
+    # 建立工具路由表，伺服器的工具清單變動時只更新該伺服器的項目
+    router = ToolRouter(clients)
+    for client in clients:
+        client.on_tools_changed = router.update
+
     try:
-        for server_info in server_infos:
-            client = MCPClient()
-            await client.connect_to_server(server_info)
-            clients.append(client)
-        await chat_loop(clients)
+        await chat_loop(router)
     finally:
         # 反向清除資源，確保所有伺服器都能正常關閉
         for client in clients[::-1]:
             await client.cleanup()
+        await llm_clients.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,135 +1,39 @@
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from contextlib import AsyncExitStack
-from openai import OpenAI
+from client_with_servers import MCPClient, get_reply_text, STREAM_OUTPUT
+from tool_router import ToolRouter
+from chat_history import ChatHistory
+import llm_clients
 import asyncio
 import json
 import sys
 import os
 
-openai = OpenAI()
-
-class MCPClient:
-    def __init__(self):
-        self.session = None
-        self.exit_stack = AsyncExitStack()
-        self.tools = []
-        self.tool_names = []
-
-    async def connect_to_server(self, server_info):
-        """連接 MCP 伺服器
-
-        Args:
-            server_info: MCP 伺服器的連接資訊
-        """
-
-        server_params = StdioServerParameters(**server_info[1])
-
-        stdio_transport = await (
-            self.exit_stack.enter_async_context(
-                stdio_client(server_params)
-            )
-        )
-        self.stdio, self.write = stdio_transport
-        self.session = await (
-            self.exit_stack.enter_async_context(
-                ClientSession(self.stdio, self.write)
-            )
-        )
-
-        await self.session.initialize()
-
-        # List available tools
-        response = await self.session.list_tools()
-        tools = response.tools
-        self.tools = [{
-            "type": "function",
-            "name": tool.name,
-            "description": tool.description,
-            "parameters": tool.inputSchema
-        } for tool in tools]
-        self.tool_names = [tool.name for tool in tools]
-
-        print('-' * 20)
-        print(f"已連接 {server_info[0]} 伺服器")
-        print('\n'.join(
-            [f'    - {name}' for name in self.tool_names]
-        ))
-        print('-' * 20)
-
-    async def cleanup(self):
-        """Clean up resources"""
-        await self.exit_stack.aclose()
-
-async def get_reply_text(client, query, hist):
-    """單次問答"""
-    
-    # 自行處理對話記錄
-    messages = hist + [{"role": "user", "content": query}]
-
-    while True:
-        # 使用 Responses API 請 LLM 生成回覆
-        response = openai.responses.create(
-            # model="gpt-4.1-mini",
-            model="gpt-4.1",
-            input=messages,
-            tools=client.tools,
-            store=False # 不儲存對話紀錄
-        )
-
-        # Process response and handle tool calls
-        tool_results = []
-        final_text = []
-
-        for output in response.output:
-            if output.type == 'message': # 一般訊息
-                final_text.append(output.content[0].text)
-            elif output.type == 'function_call': # 使用工具
-                tool_name = output.name
-                tool_args = eval(output.arguments)
-
-                print(f"準備使用 {tool_name}(**{tool_args})")
-                print('-' * 20)
-                # 使用 MCP 伺服器提供的工具
-                result = await client.session.call_tool(
-                    tool_name, tool_args
-                )
-                tool_results.append(
-                    {"call": tool_name, "result": result}
-                )
-                print(f"{result.content[0].text}")
-                print('-' * 20)
-
-                messages.append(output)
-                messages.append({
-                    # 建立可傳回函式執行結果的字典
-                    "type": "function_call_output", # 設為工具輸出類型的訊息
-                    "call_id": output.call_id, # 叫用函式的識別碼
-                    "output": result.content[0].text # 函式傳回值
-                })
-        if tool_results == []:
-            break
-    return "\n".join(final_text)
-
-async def chat_loop(client):
+async def chat_loop(router):
     """聊天迴圈"""
     print("直接按 ↵ 可結束對話")
 
-    hist = []
+    # 依 token 預算保留對話紀錄，超過預算時把最舊的對話摘要成一則訊息
+    hist = ChatHistory(summarizer=llm_clients.openai_summarizer())
     while True:
         try:
-            query = input(">>> ").strip()
+            # 在另一個執行緒等待輸入，避免卡住 event loop
+            query = (await asyncio.to_thread(input, ">>> ")).strip()
 
             if query == '':
                 break
 
+            # 單一伺服器也使用多伺服器版本的問答流程，
+            # 同一輪的多個工具呼叫一樣可以同時執行
+            usage = llm_clients.TokenUsage()
             reply = await get_reply_text(
-                client, query, hist
+                router, query, hist.messages, usage
             )
-            print(reply)
-            hist += [{"role": "user", "content": query}]
-            hist += [{"role": "assistant", "content": reply}]
-            hist = hist[-6:] # 只保留最近的 10 筆對話紀錄
+            if not STREAM_OUTPUT: # 串流模式已經即時顯示過回覆
+                print(reply)
+            print(usage.report()) # 這一輪命中提示快取的 token 數
+            await hist.add_turn([
+                {"role": "user", "content": query},
+                {"role": "assistant", "content": reply}
+            ])
 
         except Exception as e:
             print(f"\nError: {str(e)}")
@@ -163,9 +67,12 @@ async def main():
     
     try:
         await client.connect_to_server(server_infos[0])
-        await chat_loop(client)
+        router = ToolRouter([client])
+        client.on_tools_changed = router.update
+        await chat_loop(router)
     finally:
         await client.cleanup()
+        await llm_clients.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
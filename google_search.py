@@ -0,0 +1,84 @@
+"""三個 Google 搜尋伺服器共用的搜尋功能
+
+取代原本各伺服器直接在 async 工具中呼叫 googlesearch.search：
+- search 是同步的 generator，放到執行緒池中執行，不會卡住其他請求
+- 以 (關鍵字, 結果數量, 語言) 為鍵值快取搜尋結果，
+  超過存活時間或數量上限時移除最舊的結果
+- 相同的搜尋同時進行時只會真的搜尋一次，共用同一個結果
+- 真正送出的搜尋經過 SearchScheduler 控制速率，避免被 Google 限流
+- search_stats() 傳回排程器的佇列深度與快取命中統計，
+  各伺服器以 google_search_stats 工具提供
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from googlesearch import search
+
+from call_cache import SingleFlight, TTLCache
+from search_scheduler import NORMAL, SearchScheduler
+
+LANG = "zh-TW"          # 預設的搜尋語言
+MIN_RESULTS = 5         # 最少取得的結果數量
+SEARCH_TTL = 600        # 搜尋結果的快取秒數
+SEARCH_CACHE_SIZE = 256 # 最多快取的搜尋數
+MAX_SEARCH_WORKERS = 4  # 同時進行的搜尋數
+# 每秒最多送出的搜尋數，多個 worker 時由 serve_google_search.py 平分
+SEARCH_RATE = float(os.getenv("GOOGLE_SEARCH_RATE", "0.5"))
+SEARCH_BURST = 3        # 閒置後最多可以連續送出的搜尋數
+MAX_SEARCH_QUEUE = 100  # 最多排隊等待的搜尋數
+
+executor = ThreadPoolExecutor(
+    max_workers=MAX_SEARCH_WORKERS, thread_name_prefix="google_search"
+)
+scheduler = SearchScheduler(
+    SEARCH_RATE, SEARCH_BURST, executor, max_queue=MAX_SEARCH_QUEUE
+)
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_TTL)
+inflight = SingleFlight() # 進行中的搜尋
+
+def search_markdown(keyword: str, num_results: int, lang: str) -> str:
+    """實際進行搜尋，以 markdown 格式整理搜尋結果"""
+    lines = []
+    for result in search(
+        keyword,
+        advanced=True,
+        num_results=num_results,
+        lang=lang
+    ):
+        lines.append(f"- [{result.title}]({result.url})\n"
+                     f"    {result.description}\n")
+    return "".join(lines)
+
+def search_stats() -> dict:
+    """排程器的佇列深度、限流次數與快取命中統計
+
+    以多個 worker 執行時是處理這個請求的 worker 自己的統計
+    """
+    return {"scheduler": scheduler.metrics(), "cache": search_cache.stats()}
+
+async def google_search(keyword: str, num_results: int = MIN_RESULTS,
+                        lang: str = LANG, priority: int = NORMAL) -> str:
+    """使用 Google 搜尋關鍵字，傳回 markdown 格式的搜尋結果
+
+    Args:
+        keyword: 搜尋關鍵字
+        num_results: 搜尋結果數量，最少 MIN_RESULTS 筆
+        lang: 搜尋語言
+        priority: 排隊時的優先序，數字小的優先
+
+    Raises:
+        SchedulerBusy: 排隊的搜尋太多
+    """
+    keyword = " ".join(keyword.split())
+    num_results = max(num_results, MIN_RESULTS)
+    key = (keyword, num_results, lang)
+    content = search_cache.get(key)
+    if content is not None:
+        return content
+    return await inflight.run(
+        key,
+        lambda: scheduler.run(
+            search_markdown, keyword, num_results, lang, priority=priority
+        ),
+        lambda content: search_cache.put(key, content)
+    )
@@ -1,7 +1,19 @@
+import json
+import os
+
 from mcp.server.fastmcp import FastMCP
-from googlesearch import search
+from google_search import google_search, search_stats
+
+# 以多個 worker 執行時每個請求可能由不同的行程處理，session 無法共用，
+# 由 serve_google_search.py 設定 MCP_STATELESS_HTTP=1 改用無狀態模式：
+# 每個請求各自處理、不發 mcp-session-id，並直接以 JSON 回應
+STATELESS = os.getenv("MCP_STATELESS_HTTP") == "1"
 
-mcp = FastMCP("shell_helper")
+mcp = FastMCP(
+    "shell_helper",
+    stateless_http=STATELESS,
+    json_response=STATELESS
+)
 
 @mcp.tool()
 async def google_res(keyword: str, num_results: int = 5) -> str:
@@ -10,18 +22,18 @@ async def google_res(keyword: str, num_results: int = 5) -> str:
         keyword (str): 搜尋關鍵字
         num_results (int): 搜尋結果數量，預設為 5 筆
     """
-    content = ""
-    num_results = max(num_results, 5) # 最少 5 筆
-    for result in search( # 一一串接搜尋結果
-        keyword,
-        advanced=True,
-        num_results=num_results,
-        lang='zh-TW'
-    ):
-        # 使用 markdown 格式整理搜尋結果
-        content += (f"- [{result.title}]({result.url})\n"
-                    f"    {result.description}\n")
-    return content
+    # 在執行緒中搜尋並快取結果，相同的搜尋同時進行時只搜尋一次
+    return await google_search(keyword, num_results)
+
+@mcp.tool()
+async def google_search_stats() -> str:
+    """可以查詢 Google 搜尋排隊中的搜尋數（佇列深度）、限流次數
+    與搜尋結果快取的命中統計"""
+    return json.dumps(search_stats())
+
+def create_app():
+    """給 uvicorn 的 app factory，每個 worker 各自建立一個 app"""
+    return mcp.streamable_http_app()
 
 if __name__ == "__main__":
     # 執行伺服器
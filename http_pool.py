@@ -0,0 +1,58 @@
+"""共用的 httpx.AsyncClient 連線池
+
+llm_clients 的 OpenAI / Anthropic 用戶端與 mcp_http 的遠端 MCP 連線
+都從這裡取得連線池，同一個行程只有一個連線池，也只需要關閉一次：
+- create_http_client()：依參數建立新的連線池，由呼叫端自行關閉
+- get_http_client()：行程共用的連線池，第一次呼叫時才建立
+- aclose()：關閉共用的連線池，程式結束前呼叫
+
+OpenAI 與 Anthropic 的 SDK 每次請求都會指定逾時，連線池的預設逾時
+只影響沒有指定逾時的請求，例如 MCP streamable-HTTP 的 POST。
+"""
+import httpx
+
+MAX_CONNECTIONS = 20           # 同時開啟的連線數量上限
+MAX_KEEPALIVE_CONNECTIONS = 10 # 閒置時保留的連線數量
+KEEPALIVE_EXPIRY = 120         # 閒置連線保留的秒數，長時間執行的 agent
+                               # 不必一直重新建立連線
+HTTP_TIMEOUT = 30              # 請求沒有指定逾時時的逾時秒數
+READ_TIMEOUT = 300             # 等待回應資料（例如 SSE 事件）的逾時秒數
+
+_http_client = None
+
+def create_http_client(keepalive_expiry=KEEPALIVE_EXPIRY,
+                       timeout=HTTP_TIMEOUT, read_timeout=READ_TIMEOUT,
+                       max_connections=MAX_CONNECTIONS,
+                       max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS):
+    """依參數建立新的 httpx.AsyncClient
+
+    Args:
+        keepalive_expiry: 閒置連線保留的秒數
+        timeout: 請求沒有指定逾時時的逾時秒數
+        read_timeout: 等待回應資料的逾時秒數
+        max_connections: 同時開啟的連線數量上限
+        max_keepalive_connections: 閒置時保留的連線數量
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, read=read_timeout),
+        follow_redirects=True,
+    )
+
+def get_http_client():
+    """取得行程共用的 httpx.AsyncClient，第一次呼叫時才建立"""
+    global _http_client
+    if _http_client is None:
+        _http_client = create_http_client()
+    return _http_client
+
+async def aclose():
+    """關閉共用的連線池，程式結束前呼叫"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
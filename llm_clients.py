@@ -0,0 +1,134 @@
+"""共用的非同步 LLM 用戶端
+
+所有 client 都透過這裡取得 AsyncOpenAI / AsyncAnthropic，
+兩者與 mcp_http 共用 http_pool 的連線池。等待模型回覆時不會卡住
+event loop，MCP session 的通知可以照常處理，同一個行程中的多段
+對話也不必排隊等待彼此的模型呼叫。
+
+TokenUsage 累計每輪對話的輸入 token 數，區分命中提示快取與否，
+兩家 API 的 usage 都可以使用。
+
+openai_summarizer 與 anthropic_summarizer 建立 ChatHistory 的
+summarizer，以較便宜的模型把超過預算的舊對話摘要成一則訊息。
+"""
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+
+from chat_history import message_text
+from http_pool import get_http_client
+import http_pool
+
+# 摘要舊對話的設定
+OPENAI_SUMMARY_MODEL = "gpt-4.1-mini"
+ANTHROPIC_SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+SUMMARY_MAX_TOKENS = 500 # 摘要的 token 上限，避免摘要佔掉太多對話預算
+SUMMARY_PROMPT = (
+    "把以下對話整理成簡短的摘要，保留之後的對話可能用到的事實、"
+    "決定與使用者的偏好，只輸出摘要本身。"
+)
+
+_openai = None
+_anthropic = None
+
+def get_async_openai():
+    """取得共用連線池的 AsyncOpenAI 用戶端"""
+    global _openai
+    if _openai is None:
+        _openai = AsyncOpenAI(http_client=get_http_client())
+    return _openai
+
+def get_async_anthropic():
+    """取得共用連線池的 AsyncAnthropic 用戶端"""
+    global _anthropic
+    if _anthropic is None:
+        _anthropic = AsyncAnthropic(http_client=get_http_client())
+    return _anthropic
+
+async def aclose():
+    """關閉共用的連線池，程式結束前呼叫
+
+    mcp_http 的遠端 MCP 連線也使用同一個連線池，一併關閉
+    """
+    global _openai, _anthropic
+    await http_pool.aclose()
+    _openai = _anthropic = None
+
+def summary_input(summary, messages):
+    """把先前的摘要與要移除的訊息整理成給摘要模型的文字"""
+    lines = []
+    if summary:
+        lines.append(f"先前的摘要：\n{summary}\n")
+    for message in messages:
+        if isinstance(message, dict):
+            role = message.get("role", message.get("type", "tool"))
+        else:
+            role = getattr(message, "type", "tool")
+        lines.append(f"{role}: {message_text(message)}")
+    return "\n".join(lines)
+
+def openai_summarizer(model=OPENAI_SUMMARY_MODEL):
+    """建立以 OpenAI Responses API 摘要舊對話的 summarizer"""
+    async def summarize(summary, messages):
+        response = await get_async_openai().responses.create(
+            model=model,
+            instructions=SUMMARY_PROMPT,
+            input=summary_input(summary, messages),
+            max_output_tokens=SUMMARY_MAX_TOKENS,
+        )
+        return response.output_text
+    return summarize
+
+def anthropic_summarizer(model=ANTHROPIC_SUMMARY_MODEL):
+    """建立以 Anthropic Messages API 摘要舊對話的 summarizer"""
+    async def summarize(summary, messages):
+        message = await get_async_anthropic().messages.create(
+            model=model,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            system=SUMMARY_PROMPT,
+            messages=[{
+                "role": "user",
+                "content": summary_input(summary, messages)
+            }],
+        )
+        return "".join(block.text for block in message.content
+                       if block.type == "text")
+    return summarize
+
+class TokenUsage:
+    """累計一輪對話中所有模型呼叫的 token 數"""
+    def __init__(self):
+        self.requests = 0    # 模型呼叫次數
+        self.input = 0       # 輸入 token 總數，包含快取的部分
+        self.cached = 0      # 命中快取的輸入 token 數
+        self.cache_write = 0 # 寫入快取的輸入 token 數（Anthropic）
+        self.output = 0
+
+    def add(self, usage):
+        """加入一次回覆的 usage，Anthropic 與 OpenAI Responses API 皆可"""
+        if usage is None:
+            return
+        self.requests += 1
+        if hasattr(usage, "cache_read_input_tokens"):
+            # Anthropic 的 input_tokens 不含讀取與寫入快取的部分
+            read = usage.cache_read_input_tokens or 0
+            write = usage.cache_creation_input_tokens or 0
+            self.input += usage.input_tokens + read + write
+            self.cached += read
+            self.cache_write += write
+        else:
+            self.input += usage.input_tokens
+            details = getattr(usage, "input_tokens_details", None)
+            self.cached += getattr(details, "cached_tokens", 0) or 0
+        self.output += usage.output_tokens
+
+    def report(self):
+        """一行的統計文字"""
+        ratio = self.cached / self.input if self.input else 0.0
+        text = (
+            f"[tokens] {self.requests} 次呼叫，輸入 {self.input}"
+            f"（快取 {self.cached}，{ratio:.0%}；"
+            f"未快取 {self.input - self.cached}"
+        )
+        if self.cache_write:
+            text += f"，寫入快取 {self.cache_write}"
+        return text + f"），輸出 {self.output}"
@@ -0,0 +1,317 @@
+"""可自動重新連線的 streamable-HTTP MCP 連線
+
+- 所有遠端 MCP 伺服器與 llm_clients 共用 http_pool 的連線池，
+  閒置連線保留較久，長時間執行的 agent 不必一直重新建立連線
+- 連線中斷時以指數退避重新連線，先帶著原本的 mcp-session-id 接續
+  原本的 session，只送一個 ping 確認，不必重新初始化；伺服器已經
+  不認得這個 session（例如重新啟動過）時才在同一個連線上重新初始化
+- 連線中斷時進行中的請求會在重新連線後重送
+
+MCP SDK 1.9.1 的 streamablehttp_client 每次都自行建立 httpx 用戶端，
+也無法指定 session id，因此這裡直接使用 SDK 的
+StreamableHTTPTransport 組出相同的傳輸層。SDK 只把 404 當成 session
+已經結束，但 FastMCP 1.9.1 對不認得的 session id 回應 400，其他狀態碼
+會讓整個傳輸層結束，因此 SessionTransport 把兩者都轉成 session 結束
+的錯誤。
+"""
+from contextlib import asynccontextmanager, suppress
+from datetime import timedelta
+import asyncio
+import random
+import sys
+
+import anyio
+import httpx
+from mcp import ClientSession
+from mcp.client.streamable_http import StreamableHTTPTransport
+from mcp.shared.exceptions import McpError
+from mcp.shared.message import SessionMessage
+from mcp.types import JSONRPCRequest
+
+from http_pool import get_http_client
+
+# 傳輸層設定
+HTTP_TIMEOUT = 30      # 一般請求的逾時秒數
+SSE_READ_TIMEOUT = 300 # 等待 SSE 事件的逾時秒數
+
+# 重新連線設定
+RECONNECT_BASE = 0.5 # 第一次重新連線前等待的秒數，之後每次加倍
+RECONNECT_MAX = 30   # 單次等待的上限秒數
+CONNECT_WAIT = 60    # 請求等待重新連線的秒數上限
+MAX_CALL_RETRIES = 2 # 連線中斷時請求最多重送幾次
+
+# 伺服器不認得 session id 時的狀態碼：SDK 規定的 404 與 FastMCP 的 400
+SESSION_GONE_STATUS = {400, 404}
+
+class SessionTransport(StreamableHTTPTransport):
+    """伺服器不認得 session id 時，以 session 結束的錯誤回應該請求
+
+    SDK 只處理 404，其他狀態碼的 HTTPStatusError 會結束整個傳輸層，
+    連線只能整個重建，無法在同一個連線上重新初始化。
+    """
+    async def _handle_post_request(self, ctx):
+        try:
+            await super()._handle_post_request(ctx)
+        except httpx.HTTPStatusError as e:
+            message = ctx.session_message.message
+            if (ctx.session_id is None
+                    or e.response.status_code not in SESSION_GONE_STATUS
+                    or not isinstance(message.root, JSONRPCRequest)):
+                raise
+            await self._send_session_terminated_error(
+                ctx.read_stream_writer, message.root.id
+            )
+
+@asynccontextmanager
+async def open_transport(url, headers=None, session_id=None,
+                         http_client=None):
+    """與 streamablehttp_client 相同的傳輸層，但使用共用的連線池
+
+    Args:
+        url: MCP 伺服器的網址
+        headers: 每個請求額外加上的標頭
+        session_id: 要接續的 session id，None 表示建立新的 session
+        http_client: 使用的 httpx.AsyncClient，None 表示共用的連線池
+
+    Yields:
+        (read_stream, write_stream, transport)
+    """
+    transport = SessionTransport(
+        url, headers,
+        timedelta(seconds=HTTP_TIMEOUT),
+        timedelta(seconds=SSE_READ_TIMEOUT)
+    )
+    transport.session_id = session_id
+    client = http_client or get_http_client()
+
+    read_stream_writer, read_stream = anyio.create_memory_object_stream[
+        SessionMessage | Exception
+    ](0)
+    write_stream, write_stream_reader = anyio.create_memory_object_stream[
+        SessionMessage
+    ](0)
+
+    async with anyio.create_task_group() as tg:
+        try:
+            def start_get_stream():
+                tg.start_soon(
+                    transport.handle_get_stream, client, read_stream_writer
+                )
+
+            tg.start_soon(
+                transport.post_writer,
+                client,
+                write_stream_reader,
+                read_stream_writer,
+                write_stream,
+                start_get_stream,
+                tg,
+            )
+            if session_id:
+                # 接續的 session 不會再送 initialized 通知，
+                # 要自己開啟接收伺服器通知的 GET 串流
+                start_get_stream()
+            try:
+                yield read_stream, write_stream, transport
+            finally:
+                tg.cancel_scope.cancel()
+        finally:
+            await read_stream_writer.aclose()
+            await write_stream.aclose()
+
+def is_session_terminated(error):
+    """伺服器回應 400 或 404，表示已經不認得這個 session"""
+    return (isinstance(error, McpError)
+            and error.error.message == "Session terminated")
+
+class ResilientSession:
+    """可自動重新連線的 streamable-HTTP MCP session
+
+    提供與 ClientSession 相同的 call_tool()、list_tools() 與
+    send_ping()，連線由背景 task 持有，中斷時自動重新連線。
+    連線中斷時進行中的請求會重送，工具呼叫可能因此執行兩次，
+    有副作用的工具可以把 retry_calls 設為 False。
+    """
+    def __init__(self, url, headers=None, message_handler=None,
+                 on_reconnect=None, http_client=None, retry_calls=True):
+        """
+        Args:
+            url: MCP 伺服器的網址
+            headers: 每個請求額外加上的標頭
+            message_handler: 傳給 ClientSession 的 message_handler
+            on_reconnect: 重新連線後呼叫的函式 on_reconnect(resumed)，
+                          resumed 為 False 表示重新初始化了 session
+            http_client: 使用的 httpx.AsyncClient，None 表示共用的連線池
+            retry_calls: 連線中斷時是否重送進行中的請求
+        """
+        self.url = url
+        self.headers = headers
+        self.message_handler = message_handler
+        self.on_reconnect = on_reconnect
+        self.http_client = http_client
+        self.retry_calls = retry_calls
+        self.session = None    # 目前的 ClientSession
+        self.session_id = None # 目前的 mcp-session-id
+        self.reconnects = 0    # 重新連線次數
+        self.resumed = 0       # 其中成功接續原本 session 的次數
+        self._connected = asyncio.Event()
+        self._reset = asyncio.Event()   # 要求捨棄目前的 session
+        self._closing = asyncio.Event() # 要求關閉連線
+        self._lost = None               # 目前的連線中斷時完成的 future
+        self._task = None
+
+    async def connect(self, timeout=None):
+        """在背景 task 中連線，第一次連線完成後才返回，失敗時丟出例外"""
+        ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._serve(ready))
+        try:
+            await asyncio.wait_for(asyncio.shield(ready), timeout)
+        except BaseException:
+            self._task.cancel()
+            with suppress(BaseException):
+                await self._task
+            raise
+
+    async def close(self):
+        """結束 session 並關閉連線"""
+        if self._task is None:
+            return
+        self._closing.set()
+        with suppress(BaseException):
+            await self._task
+
+    async def call_tool(self, name, arguments=None):
+        return await self._request("call_tool", name, arguments)
+
+    async def list_tools(self):
+        return await self._request("list_tools")
+
+    async def send_ping(self):
+        return await self._request("send_ping")
+
+    async def _request(self, method, *args):
+        """透過目前的 session 送出請求，連線中斷時等重新連線後重送"""
+        retries = MAX_CALL_RETRIES if self.retry_calls else 0
+        for attempt in range(retries + 1):
+            session, lost = await self._current()
+            call = asyncio.ensure_future(getattr(session, method)(*args))
+            try:
+                done, _ = await asyncio.wait(
+                    {call, lost}, return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                if not call.done():
+                    call.cancel()
+            if call in done:
+                error = call.exception()
+                if error is None:
+                    return call.result()
+                if not is_session_terminated(error):
+                    raise error
+                # 伺服器已經不認得這個 session，重新初始化後再送
+                self._reset_session()
+            if attempt < retries:
+                print(f"與 {self.url} 的連線中斷，重新連線後重送 {method}",
+                      file=sys.stderr)
+        raise ConnectionError(f"與 {self.url} 的連線中斷")
+
+    async def _current(self):
+        """等待連線完成，傳回 (ClientSession, 連線中斷時完成的 future)"""
+        if self._task is None or self._task.done():
+            raise ConnectionError(f"未連接 {self.url}")
+        try:
+            await asyncio.wait_for(self._connected.wait(), CONNECT_WAIT)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"無法重新連接 {self.url}") from None
+        return self.session, self._lost
+
+    def _reset_session(self):
+        """捨棄目前的 session，讓背景 task 重新連線並初始化"""
+        self.session_id = None
+        self._connected.clear()
+        self._reset.set()
+
+    async def _start(self, session, transport, resume_id):
+        """接續原本的 session，不行時重新初始化
+
+        Returns:
+            是否成功接續原本的 session
+        """
+        if resume_id:
+            try:
+                await session.send_ping()
+                return True
+            except McpError as e:
+                if not is_session_terminated(e):
+                    raise
+            # 伺服器不認得這個 session，在同一個連線上重新初始化
+            transport.session_id = None
+        await session.initialize()
+        return False
+
+    async def _serve(self, ready):
+        """持有連線，中斷時以指數退避重新連線，直到 close() 要求關閉"""
+        loop = asyncio.get_running_loop()
+        delay = 0.0
+        while not self._closing.is_set():
+            self._lost = loop.create_future()
+            resume_id = self.session_id
+            try:
+                async with open_transport(
+                    self.url, self.headers, resume_id, self.http_client
+                ) as (read, write, transport):
+                    async with ClientSession(
+                        read, write, message_handler=self.message_handler
+                    ) as session:
+                        try:
+                            resumed = await self._start(
+                                session, transport, resume_id
+                            )
+                        except BaseException:
+                            self.session_id = None # 下次不再嘗試接續
+                            raise
+                        self.session = session
+                        self.session_id = transport.get_session_id()
+                        self._reset.clear()
+                        self._connected.set()
+                        delay = 0.0
+                        if not ready.done():
+                            ready.set_result(self)
+                        else:
+                            self.resumed += resumed
+                            if self.on_reconnect is not None:
+                                self.on_reconnect(resumed)
+                        await self._wait_for_reset()
+                        if self._closing.is_set():
+                            await transport.terminate_session(
+                                self.http_client or get_http_client()
+                            )
+            except Exception as e:
+                if not ready.done():
+                    ready.set_exception(e)
+                    return
+                print(f"與 {self.url} 的連線中斷：{e!r}", file=sys.stderr)
+            finally:
+                self._connected.clear()
+                self.session = None
+                if not self._lost.done():
+                    self._lost.set_result(None)
+
+            if self._closing.is_set():
+                break
+            delay = min(max(delay * 2, RECONNECT_BASE), RECONNECT_MAX)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._closing.wait(), delay * random.uniform(0.5, 1.0)
+                )
+            self.reconnects += 1
+
+    async def _wait_for_reset(self):
+        """等到 close() 要求關閉或需要捨棄目前的 session"""
+        waiters = [asyncio.create_task(self._closing.wait()),
+                   asyncio.create_task(self._reset.wait())]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
@@ -0,0 +1,220 @@
+"""FastMCP 伺服器的請求追蹤
+
+取代在工具中直接以 rich 的 pprint 印出 Context 的除錯方式：
+- 預設關閉，關閉時每次呼叫只多一次層級比較
+- 分成 SUMMARY（工具名稱、參數、client_id、request_id、耗時與錯誤）
+  與 DETAIL（另外加上請求的 meta 與用戶端的 client_params）兩個層級
+- 開啟時依取樣比例只記錄部分呼叫，失敗的呼叫一律記錄
+- 工具的執行緒只把原始物件放進佇列，轉成 JSON 與寫檔都在背景
+  執行緒中進行；沒有指定檔案時保留在記憶體中的環狀緩衝區
+- 寫入跟不上時丟棄紀錄並計數，不會拖慢工具也不會無限制地佔用記憶體
+
+以環境變數設定：
+    MCP_TRACE         off、summary 或 detail，預設 off
+    MCP_TRACE_SAMPLE  記錄的比例，0 到 1，預設 0.1
+    MCP_TRACE_FILE    寫入的 JSON Lines 檔案，未設定時使用環狀緩衝區
+    MCP_TRACE_BUFFER  環狀緩衝區保留的紀錄數，預設 1000
+
+用法：
+    tracer = Tracer.from_env()
+
+    @mcp.tool()
+    @tracer.traced
+    def add(a: int, b: int, ctx: Context) -> int:
+        ...
+"""
+from collections import deque
+import atexit
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from mcp.server.fastmcp import Context
+
+OFF = 0
+SUMMARY = 1
+DETAIL = 2
+LEVELS = {"off": OFF, "summary": SUMMARY, "detail": DETAIL}
+
+SAMPLE_RATE = 0.1   # 預設記錄的比例
+BUFFER_SIZE = 1000  # 環狀緩衝區預設保留的紀錄數
+MAX_PENDING = 10000 # 等待寫入的紀錄數上限，超過時丟棄
+
+def to_json(value):
+    """json.dumps 無法處理的物件轉成可以序列化的形式"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return repr(value)
+
+class Tracer:
+    """記錄工具呼叫的追蹤器"""
+    def __init__(self, level=OFF, sample=SAMPLE_RATE, path=None,
+                 buffer_size=BUFFER_SIZE):
+        """
+        Args:
+            level: OFF、SUMMARY 或 DETAIL
+            sample: 記錄的比例，0 到 1
+            path: 寫入的 JSON Lines 檔案，None 表示使用環狀緩衝區
+            buffer_size: 環狀緩衝區保留的紀錄數
+        """
+        self.level = level
+        self.sample = sample
+        self.path = path
+        self.buffer = deque(maxlen=buffer_size)
+        self.stats = {"traced": 0, "dropped": 0, "written": 0}
+        self._pending = queue.Queue(MAX_PENDING)
+        self._writer = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """依 MCP_TRACE 等環境變數建立追蹤器"""
+        name = os.getenv("MCP_TRACE", "off").strip().lower()
+        if name not in LEVELS:
+            raise ValueError(
+                f"MCP_TRACE 必須是 {'、'.join(LEVELS)} 其中之一：{name}"
+            )
+        return cls(
+            LEVELS[name],
+            float(os.getenv("MCP_TRACE_SAMPLE", SAMPLE_RATE)),
+            os.getenv("MCP_TRACE_FILE") or None,
+            int(os.getenv("MCP_TRACE_BUFFER", BUFFER_SIZE)),
+        )
+
+    def traced(self, fn):
+        """包裝工具函式，記錄每次呼叫
+
+        同步與 async 的工具都可以使用，FastMCP 看到的簽名與原本相同。
+        Context 由 FastMCP 以關鍵字參數傳入，工具沒有 Context 參數時
+        只記錄工具名稱、參數與耗時。
+        """
+        name = fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if self.level == OFF:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    self._record(name, kwargs, start, e)
+                    raise
+                self._record(name, kwargs, start)
+                return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.level == OFF:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    self._record(name, kwargs, start, e)
+                    raise
+                self._record(name, kwargs, start)
+                return result
+        return wrapper
+
+    def _record(self, name, kwargs, start, error=None):
+        """取樣後把原始物件放進佇列，由背景執行緒整理與寫入"""
+        elapsed = time.perf_counter() - start
+        if error is None and random.random() >= self.sample:
+            return
+        self._start_writer()
+        try:
+            self._pending.put_nowait(
+                (time.time(), self.level, name, kwargs, elapsed, error)
+            )
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return
+        self.stats["traced"] += 1
+
+    def _start_writer(self):
+        """第一次記錄時才啟動背景執行緒"""
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="request_trace", daemon=True
+                )
+                self._writer.start()
+                atexit.register(self.close)
+
+    def _entry(self, timestamp, level, name, kwargs, elapsed, error):
+        """把一筆原始紀錄整理成 dict"""
+        entry = {
+            "time": timestamp,
+            "tool": name,
+            "ms": round(elapsed * 1000, 3),
+        }
+        ctx = None
+        arguments = {}
+        for key, value in kwargs.items():
+            if isinstance(value, Context):
+                ctx = value
+            else:
+                arguments[key] = value
+        entry["arguments"] = arguments
+        if ctx is not None:
+            entry["client_id"] = ctx.client_id
+            entry["request_id"] = ctx.request_id
+            if level >= DETAIL:
+                entry["meta"] = ctx.request_context.meta
+                entry["client_params"] = ctx.session.client_params
+        if error is not None:
+            entry["error"] = repr(error)
+        return entry
+
+    def _write_loop(self):
+        output = open(self.path, "a", encoding="utf-8") if self.path else None
+        try:
+            while True:
+                record = self._pending.get()
+                if record is None:
+                    break
+                batch = [record]
+                # 一次取出所有等待中的紀錄，批次寫入
+                while True:
+                    try:
+                        record = self._pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is None:
+                        self._pending.put(None)
+                        break
+                    batch.append(record)
+                entries = [self._entry(*record) for record in batch]
+                if output is None:
+                    self.buffer.extend(entries)
+                else:
+                    output.write("".join(
+                        json.dumps(entry, ensure_ascii=False, default=to_json)
+                        + "\n" for entry in entries
+                    ))
+                    output.flush()
+                self.stats["written"] += len(entries)
+        finally:
+            if output is not None:
+                output.close()
+
+    def recent(self, count=None):
+        """傳回環狀緩衝區中最近的紀錄，最新的在最後"""
+        entries = list(self.buffer)
+        return entries if count is None else entries[-count:]
+
+    def close(self):
+        """寫完等待中的紀錄後結束背景執行緒"""
+        if self._writer is None or not self._writer.is_alive():
+            return
+        self._pending.put(None)
+        self._writer.join()
@@ -0,0 +1,190 @@
+"""限制搜尋速率的排程器
+
+放在搜尋後端前面，避免多個 agent 同時搜尋時被 Google 限流：
+- 以 token bucket 控制送出請求的速率，允許短暫的突發
+- 等待中的請求放在優先佇列，數字小的優先，同優先序先到先送
+- 收到 429 時暫停送出並降低速率，之後每次成功再慢慢調回來，
+  但不超過上次被限流時的速率，避免反覆被限流；
+  被限流的請求會重新排入佇列而不是直接失敗
+- 佇列太長時拒絕新的請求，並統計佇列深度等數據
+"""
+from concurrent.futures import Executor
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Callable
+
+HIGH, NORMAL, LOW = 0, 1, 2 # 優先序
+
+class SchedulerBusy(RuntimeError):
+    """佇列已滿，請稍後再試"""
+
+def is_throttled(error: BaseException) -> bool:
+    """判斷例外是否為 429 Too Many Requests"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+def retry_after(error: BaseException) -> float | None:
+    """取出 429 回應中的 Retry-After 秒數"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+class SearchScheduler:
+    """以 token bucket 與優先佇列排程同步的搜尋函式"""
+    def __init__(self, rate: float, burst: int = 1,
+                 executor: Executor | None = None, max_queue: int = 100,
+                 max_retries: int = 3, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, min_rate: float | None = None):
+        """
+        Args:
+            rate: 每秒最多送出的請求數
+            burst: 閒置後最多可以連續送出的請求數
+            executor: 執行搜尋函式的執行緒池，None 表示使用預設的執行緒池
+            max_queue: 佇列中最多等待的請求數，超過時丟出 SchedulerBusy
+            max_retries: 被限流的請求最多重新排入佇列幾次
+            backoff_base: 第一次被限流時暫停的秒數，連續被限流時加倍
+            backoff_max: 單次暫停的上限秒數，包含 Retry-After
+            min_rate: 被限流時速率最低降到多少，預設為 rate 的 1/8
+        """
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 8
+        self.rate = rate
+        self.ceiling = rate    # 成功時速率最多調回多少
+        self.burst = burst
+        self.executor = executor
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff = 0.0    # 目前的暫停秒數，成功後歸零
+        self._queue = []       # [(優先序, 序號, future, 重試次數, func, args)]
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._running = set()  # 執行中的請求，保留參照以免被回收
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "throttled": 0,
+            "max_depth": 0,
+        }
+
+    @property
+    def depth(self) -> int:
+        """佇列中等待送出的請求數"""
+        return len(self._queue)
+
+    def metrics(self) -> dict:
+        """統計數據加上目前的佇列深度、速率與剩餘的暫停秒數"""
+        return {
+            **self.stats,
+            "depth": self.depth,
+            "rate": round(self.rate, 3),
+            "ceiling": round(self.ceiling, 3),
+            "paused": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+        }
+
+    async def run(self, func: Callable, *args, priority: int = NORMAL) -> Any:
+        """排入佇列，輪到時在執行緒中執行 func(*args) 並傳回結果"""
+        if self.depth >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise SchedulerBusy(
+                f"Search queue is full ({self.depth} waiting), try again later."
+            )
+        future = asyncio.get_running_loop().create_future()
+        self.stats["submitted"] += 1
+        self._push((priority, next(self._seq), future, 0, func, args))
+        return await future
+
+    def _push(self, entry: tuple) -> None:
+        heapq.heappush(self._queue, entry)
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self._updated) * self.rate,
+                          self.burst)
+        self._updated = now
+
+    def _wait_time(self) -> float:
+        """距離可以送出下一個請求的秒數"""
+        self._refill()
+        wait = self._paused_until - time.monotonic()
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(wait, 0.0)
+
+    async def _dispatch(self) -> None:
+        """依優先序在有 token 時送出請求，佇列清空後結束"""
+        while self._queue:
+            wait = self._wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            entry = heapq.heappop(self._queue)
+            if entry[2].done(): # 呼叫端已經取消
+                continue
+            self.tokens -= 1
+            task = asyncio.create_task(self._execute(entry))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, entry: tuple) -> None:
+        priority, seq, future, retries, func, args = entry
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, func, *args)
+        except Exception as e:
+            if is_throttled(e):
+                self._throttled(retry_after(e))
+                if retries < self.max_retries and not future.done():
+                    # 以原本的序號重新排入，排在之後才送出的請求前面
+                    self._push((priority, seq, future, retries + 1,
+                                func, args))
+                    return
+            self.stats["failed"] += 1
+            if not future.done():
+                future.set_exception(e)
+            return
+        self._succeeded()
+        self.stats["completed"] += 1
+        if not future.done():
+            future.set_result(result)
+
+    def _throttled(self, delay: float | None) -> None:
+        """被限流：暫停送出、速率減半並清空累積的 token"""
+        self.stats["throttled"] += 1
+        now = time.monotonic()
+        if now < self._paused_until:
+            return # 暫停前就送出的請求，不重複降速
+        self._backoff = min(max(self._backoff * 2, self.backoff_base),
+                            self.backoff_max)
+        if delay is None:
+            delay = self._backoff * random.uniform(0.5, 1.0)
+        self._paused_until = max(self._paused_until,
+                                 now + min(delay, self.backoff_max))
+        self.ceiling = max(self.rate * 0.9, self.min_rate)
+        self.rate = max(self.rate / 2, self.min_rate)
+        # 暫停期間不累積 token，恢復後一個一個慢慢送，而不是一次送出一批
+        self._refill()
+        self.tokens = 0.0
+        self._updated = self._paused_until
+
+    def _succeeded(self) -> None:
+        """成功：速率慢慢調回上次被限流前，上限本身也緩慢回升"""
+        self._backoff = 0.0
+        self.rate = min(self.rate + self.max_rate / 20, self.ceiling)
+        self.ceiling = min(self.ceiling + self.max_rate / 200, self.max_rate)
@@ -0,0 +1,88 @@
+"""以多個 uvicorn worker 執行 Google 搜尋 MCP 伺服器
+
+用法：uv run serve_google_search.py [--transport http|sse] [--host HOST]
+                                    [--port PORT] [--workers N]
+
+mcp.run() 只會以單一行程執行，只用到一個 CPU 核心。這裡改用
+uvicorn 的 app factory 讓每個 worker 各自建立 FastMCP 的 Starlette app：
+- streamable-HTTP 以多個 worker 執行時改用無狀態模式，請求可以由
+  任何一個 worker 處理；單一 worker 時維持原本有 session 的模式
+- SSE 的 session 與串流都存在建立連線的行程中，後續的 POST 送到
+  其他 worker 時會找不到 session，因此拒絕以多個 worker 執行
+- 每個 worker 各自有搜尋快取與 SearchScheduler，搜尋速率由
+  所有 worker 平分，合計仍不超過 --search-rate
+"""
+import argparse
+import os
+
+import uvicorn
+
+# 所有 worker 合計每秒最多送出的搜尋數，與 google_search.SEARCH_RATE 相同。
+# 這裡不能匯入 google_search：單一 worker 時 uvicorn 在同一個行程中
+# 匯入 app，必須先設定好環境變數才能讓 google_search 讀到
+SEARCH_RATE = float(os.getenv("GOOGLE_SEARCH_RATE", "0.5"))
+
+APPS = {
+    "http": "http_google_search:create_app",
+    "sse": "sse_google_search:create_app",
+}
+
+def serve(app, transport, host, port, workers,
+          search_rate=SEARCH_RATE, log_level="info"):
+    """以 uvicorn 執行 app factory
+
+    設定以環境變數傳給 worker，worker 匯入模組時才會讀取
+
+    Args:
+        app: "模組:app factory" 格式的字串
+        transport: "http" 或 "sse"
+        host: 監聽的位址
+        port: 監聽的埠號
+        workers: worker 行程數
+        search_rate: 所有 worker 合計每秒最多送出的搜尋數
+        log_level: uvicorn 與 FastMCP 的記錄層級
+    """
+    if workers < 1:
+        raise SystemExit("workers 至少要是 1")
+    if transport == "sse" and workers > 1:
+        raise SystemExit(
+            "SSE 的 session 只存在建立連線的 worker 中，客戶端之後送出的 "
+            "POST /messages/ 可能由其他 worker 處理而找不到 session，"
+            "請以 --workers 1 執行，或改用 --transport http"
+        )
+    if transport == "http" and workers > 1:
+        os.environ["MCP_STATELESS_HTTP"] = "1"
+    os.environ["GOOGLE_SEARCH_RATE"] = str(search_rate / workers)
+    # FastMCP 的 Settings 從 FASTMCP_ 開頭的環境變數讀取設定
+    os.environ["FASTMCP_LOG_LEVEL"] = log_level.upper()
+    uvicorn.run(
+        app,
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        log_level=log_level,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="以多個 worker 執行 Google 搜尋 MCP 伺服器"
+    )
+    parser.add_argument("--transport", choices=APPS, default="http",
+                        help="http 為 streamable-HTTP（預設），sse 只能單一 worker")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int,
+                        help="worker 行程數，http 預設為 CPU 核心數，sse 為 1")
+    parser.add_argument("--search-rate", type=float,
+                        default=SEARCH_RATE,
+                        help="所有 worker 合計每秒最多送出的搜尋數")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if args.workers is None:
+        args.workers = 1 if args.transport == "sse" else os.cpu_count() or 1
+    serve(APPS[args.transport], args.transport, args.host, args.port,
+          args.workers, args.search_rate, args.log_level)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,99 @@
-from mcp.server.fastmcp import FastMCP
-import subprocess, platform
+from mcp.server.fastmcp import FastMCP, Context
+from collections import deque
+import asyncio, codecs, locale, os, platform, signal, subprocess
 
 mcp = FastMCP("shell_helper")
 
+COMMAND_TIMEOUT = 60        # 單一指令的預設執行逾時秒數
+MAX_CONCURRENT_COMMANDS = 4 # 同時執行的指令數量上限
+READ_SIZE = 4096            # 每次讀取輸出的位元組數
+HEAD_BYTES = 8 * 1024       # 結果中保留的輸出開頭位元組數
+TAIL_BYTES = 8 * 1024       # 結果中保留的輸出結尾位元組數
+# 執行過程中以 MCP 的 log 與 progress 通知即時送出輸出內容，
+# client_with_servers.py 收到 log 通知時會即時顯示
+STREAM_OUTPUT = False
+# 與原本 subprocess 的 text=True 相同，以系統偏好的編碼解讀輸出
+ENCODING = locale.getpreferredencoding(False)
+
+command_slots = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
+
+class OutputBuffer:
+    """只保留開頭與結尾的輸出，記憶體用量有固定上限
+
+    輸出超過上限時捨棄中間的部分，並在結果中標示省略的位元組數，
+    避免大量輸出佔滿伺服器記憶體或 LLM 的 context。
+    """
+    def __init__(self, head_limit=HEAD_BYTES, tail_limit=TAIL_BYTES):
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.head = bytearray()
+        self.tail = deque() # 結尾的輸出片段
+        self.tail_size = 0
+        self.dropped = 0    # 捨棄的位元組數
+
+    def append(self, chunk):
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if not chunk:
+            return
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        # 捨棄超過結尾上限的最舊內容
+        while self.tail_size > self.tail_limit:
+            excess = self.tail_size - self.tail_limit
+            oldest = self.tail[0]
+            if len(oldest) <= excess:
+                self.tail.popleft()
+                removed = len(oldest)
+            else:
+                self.tail[0] = oldest[excess:]
+                removed = excess
+            self.tail_size -= removed
+            self.dropped += removed
+
+    def text(self):
+        head = bytes(self.head)
+        tail = b"".join(self.tail)
+        if self.dropped == 0:
+            return (head + tail).decode(ENCODING, errors="replace")
+        return (f"{head.decode(ENCODING, errors='replace')}"
+                f"\n...（中間省略 {self.dropped} 位元組）...\n"
+                f"{tail.decode(ENCODING, errors='replace')}")
+
+class OutputStreamer:
+    """把執行中的輸出以 MCP 通知即時送給用戶端"""
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.received = 0 # 已收到的輸出位元組數
+        self.decoders = {}
+        self.enabled = True
+
+    async def send(self, name, chunk):
+        """送出一段輸出，name 為 stdout 或 stderr"""
+        self.received += len(chunk)
+        if not self.enabled:
+            return
+        # 每個輸出各自使用漸進式解碼，避免多位元組字元被切斷
+        decoder = self.decoders.setdefault(
+            name,
+            codecs.getincrementaldecoder(ENCODING)(errors="replace")
+        )
+        text = decoder.decode(chunk)
+        try:
+            if text:
+                await self.ctx.log(
+                    "error" if name == "stderr" else "info",
+                    text,
+                    logger_name=name
+                )
+            # 用戶端有要求進度通知時才會送出
+            await self.ctx.report_progress(self.received)
+        except Exception:
+            # 通知送不出去（例如用戶端已斷線）時不影響指令執行
+            self.enabled = False
+
 @mcp.tool()
 async def get_platform() -> str:
     """取得作業系統平台
@@ -19,9 +110,57 @@ async def get_platform() -> str:
     else:        
         return "Unknown"
 
+async def start_process(platform, shell_command):
+    """依作業系統平台啟動子行程，無法執行時傳回 None"""
+    if platform == "Windows":
+        return await asyncio.create_subprocess_exec(
+            'powershell', '-Command', shell_command,
+            stdout=asyncio.subprocess.PIPE, # 擷取標準輸出
+            stderr=asyncio.subprocess.PIPE  # 擷取錯誤輸出
+        )
+    elif platform == "*nix":
+        return await asyncio.create_subprocess_shell(
+            shell_command,                   # 在 shell 中執行
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True # 獨立的行程群組，才能一併結束子孫行程
+        )
+    return None
+
+def kill_process(process):
+    """強制結束子行程以及它產生的行程
+
+    shell 本身已經結束時，背景執行的子孫行程可能還開著管道，
+    因此 *nix 下不論 shell 是否結束都結束整個行程群組
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        if process.returncode is not None:
+            return
+        # Windows 沒有行程群組，以 taskkill /T 結束 powershell 與它的子孫行程
+        killed = subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ).returncode == 0
+        if not killed:
+            process.kill()
+    except (ProcessLookupError, FileNotFoundError):
+        pass
+
+async def drain(stream, buffer, name, streamer=None):
+    """持續讀取輸出直到結束，讀到的內容加入 buffer 並即時送出"""
+    while chunk := await stream.read(READ_SIZE):
+        buffer.append(chunk)
+        if streamer is not None:
+            await streamer.send(name, chunk)
+
 @mcp.tool()
 async def shell_helper(platform: str, 
-                       shell_command: str
+                       shell_command: str,
+                       ctx: Context,
+                       timeout: float = COMMAND_TIMEOUT
 ) -> str:
     """可以依據 platform 指定的平作業系統平台執行：
        Windows 下 powershell 指令或是 Linux/MacOS 下 
@@ -31,45 +170,55 @@ async def shell_helper(platform: str,
         platform (str): 作業系統平台，"Windows" 為 Windows, 
                                    "*nix" 為 Linux 或 MacOS
         shell_command (str): 要執行的指令
+        timeout (float): 執行逾時秒數，超過會強制結束指令，預設 60 秒
     """
 
-    # 啟動子行程
-    if platform == "Windows":
-        args = ['powershell', '-Command', shell_command]
-    elif platform == "*nix":
-        args = shell_command
-    else:
+    if platform not in ("Windows", "*nix"):
         return "不支援的作業系統平台"
-    
-    process = subprocess.Popen(
-        args,
-        shell=True,             # 在 shell 中執行
-        stdout=subprocess.PIPE, # 擷取標準輸出
-        stderr=subprocess.PIPE, # 擷取錯誤輸出
-        text=True               # 以文字形式返回
-    )
 
-    result = '執行結果：\n\n```\n'
+    # 限制同時執行的指令數量，超過的呼叫會在這裡等待
+    async with command_slots:
+        # 啟動子行程
+        process = await start_process(platform, shell_command)
+        stdout, stderr = OutputBuffer(), OutputBuffer()
+        streamer = OutputStreamer(ctx) if STREAM_OUTPUT else None
+        timed_out = False
+
+        async def run():
+            # 同時讀取標準輸出與錯誤輸出，避免任一邊的管道塞滿而卡住
+            await asyncio.gather(
+                drain(process.stdout, stdout, "stdout", streamer),
+                drain(process.stderr, stderr, "stderr", streamer)
+            )
+            # 等待行程結束並取得返回碼，指令關閉管道後繼續執行時
+            # 也要受逾時限制
+            return await process.wait()
 
-    # 即時讀取輸出
-    while True:
-        output = process.stdout.readline()
-        # 如果沒有輸出且行程結束
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            result += output
+        try:
+            return_code = await asyncio.wait_for(run(), timeout)
+        except TimeoutError:
+            timed_out = True
+            kill_process(process)
+            return_code = await process.wait()
+        except asyncio.CancelledError:
+            # 用戶端取消請求時也要結束子行程，並等待行程回收
+            kill_process(process)
+            await asyncio.shield(process.wait())
+            raise
 
+    result = '執行結果：\n\n```\n'
+    result += stdout.text()
     result += "```"
 
     # 檢查錯誤輸出
-    error = process.stderr.read()
+    error = stderr.text()
     if error:
         result += f"\n\n錯誤: {error}"
 
-    # 等待行程結束並取得返回碼
-    return_code = process.wait()
-    result += f"\n\n命令執行完成，返回碼: {return_code}\n\n"
+    if timed_out:
+        result += f"\n\n命令執行超過 {timeout} 秒，已強制結束\n\n"
+    else:
+        result += f"\n\n命令執行完成，返回碼: {return_code}\n\n"
 
     return result
 
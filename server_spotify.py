@@ -1,20 +1,143 @@
-from typing import Any
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
 from mcp.server.fastmcp import FastMCP
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
-import os, json
+import asyncio, functools, os, json
+
+from call_cache import SingleFlight, TTLCache
+from chat_history import count_text_tokens
 
 
 scope = "user-read-playback-state,user-modify-playback-state"
 
-sp = spotipy.Spotify(
-    auth_manager=SpotifyOAuth(
-        client_id=os.getenv("SPOTIFY_CLIENT_ID"),
-        client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
-        redirect_uri="http://127.0.0.1:8080/callback",
-        scope=scope,
+MAX_SPOTIFY_WORKERS = 4 # 同時進行的 Spotify API 呼叫數
+DEVICES_TTL = 30        # 裝置清單的快取秒數
+SEARCH_TTL = 3600       # 搜尋結果的快取秒數
+SEARCH_CACHE_SIZE = 256 # 最多快取的搜尋關鍵字數
+# 曲目預設傳回的欄位，可以用逗號分隔的 SPOTIFY_TRACK_FIELDS 改變
+TRACK_FIELDS = [
+    field.strip() for field in os.getenv(
+        "SPOTIFY_TRACK_FIELDS", "name,artists,uri,album,duration_ms"
+    ).split(",") if field.strip()
+]
+# 可以改指向本機的假 Spotify API 來測試，這時以 SPOTIFY_ACCESS_TOKEN
+# 提供 token，不必走 OAuth 流程
+SPOTIFY_API_PREFIX = os.getenv("SPOTIFY_API_PREFIX")
+SPOTIFY_ACCESS_TOKEN = os.getenv("SPOTIFY_ACCESS_TOKEN")
+# 設為 1 時統計精簡輸出省下的位元組與 token 數，每次呼叫都要另外
+# 序列化原本的完整輸出並計算 token，預設關閉
+PAYLOAD_STATS = os.getenv("SPOTIFY_PAYLOAD_STATS") == "1"
+
+if SPOTIFY_ACCESS_TOKEN:
+    sp = spotipy.Spotify(auth=SPOTIFY_ACCESS_TOKEN)
+else:
+    sp = spotipy.Spotify(
+        auth_manager=SpotifyOAuth(
+            client_id=os.getenv("SPOTIFY_CLIENT_ID"),
+            client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
+            redirect_uri="http://127.0.0.1:8080/callback",
+            scope=scope,
+        )
     )
+if SPOTIFY_API_PREFIX:
+    sp.prefix = SPOTIFY_API_PREFIX.rstrip("/") + "/"
+
+# spotipy 是同步的，放到執行緒中執行才不會卡住其他請求
+executor = ThreadPoolExecutor(
+    max_workers=MAX_SPOTIFY_WORKERS, thread_name_prefix="spotify"
 )
+inflight = SingleFlight() # 進行中的查詢
+
+async def spotify_call(method: str, *args, coalesce: bool = False,
+                       **kwargs) -> Any:
+    """在執行緒池中呼叫 sp 的方法
+
+    Args:
+        method: spotipy.Spotify 的方法名稱
+        coalesce: 為 True 時，相同參數的並行呼叫只會送出一次請求，
+                  共用同一個結果，只適用於沒有副作用的查詢
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(getattr(sp, method), *args, **kwargs)
+    if not coalesce:
+        return await loop.run_in_executor(executor, call)
+
+    key = (method, args, tuple(sorted(kwargs.items())))
+    return await inflight.run(
+        key, lambda: loop.run_in_executor(executor, call)
+    )
+
+devices_cache = TTLCache(1, DEVICES_TTL)
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_TTL)
+
+def normalize_query(query: str) -> str:
+    """大小寫與多餘空白不同的關鍵字視為同一個搜尋"""
+    return " ".join(query.split()).casefold()
+
+async def playback_call(method: str, **kwargs) -> Any:
+    """呼叫播放控制，失敗時裝置清單可能已經過時，清除快取"""
+    try:
+        return await spotify_call(method, **kwargs)
+    except spotipy.SpotifyException:
+        devices_cache.clear()
+        raise
+
+# 曲目可以輸出的欄位，只取模型需要的值，不含 href、external_urls 等
+FIELD_GETTERS = {
+    "name": lambda item: item["name"],
+    "artists": lambda item: [artist["name"] for artist in item["artists"]],
+    "uri": lambda item: item["uri"],
+    "album": lambda item: item["album"]["name"],
+    "duration_ms": lambda item: item.get("duration_ms"),
+    "release_date": lambda item: item["album"].get("release_date"),
+    "popularity": lambda item: item.get("popularity"),
+    "explicit": lambda item: item.get("explicit"),
+}
+
+# 精簡輸出省下的量，累計所有呼叫
+payload_stats = {
+    "calls": 0,
+    "full_bytes": 0,
+    "compact_bytes": 0,
+    "full_tokens": 0,
+    "compact_tokens": 0,
+}
+
+def compact_json(data: Any) -> str:
+    """不含多餘空白、中文不跳脫的 JSON"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+def check_fields(fields: list[str] | None) -> list[str]:
+    """傳回要輸出的欄位，有不支援的欄位時丟出 ValueError"""
+    fields = fields or TRACK_FIELDS
+    unknown = [field for field in fields if field not in FIELD_GETTERS]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {unknown}, "
+            f"available fields: {list(FIELD_GETTERS)}"
+        )
+    return fields
+
+def project_track(item: dict, fields: list[str]) -> dict:
+    """只取出曲目中指定的欄位"""
+    return {field: FIELD_GETTERS[field](item) for field in fields}
+
+def record_payload(full: Callable[[], Any], compact: str) -> None:
+    """記錄精簡前後的大小，只在 PAYLOAD_STATS 開啟時呼叫
+
+    Args:
+        full: 傳回原本完整輸出內容的函式，需要統計時才建立
+        compact: 精簡後的輸出
+    """
+    if not PAYLOAD_STATS:
+        return
+    full = json.dumps(full())
+    payload_stats["calls"] += 1
+    payload_stats["full_bytes"] += len(full.encode())
+    payload_stats["compact_bytes"] += len(compact.encode())
+    payload_stats["full_tokens"] += count_text_tokens(full)
+    payload_stats["compact_tokens"] += count_text_tokens(compact)
 
 mcp = FastMCP("shell_helper")
 
@@ -23,34 +146,54 @@ mcp = FastMCP("shell_helper")
 async def spotify_devices() -> str:
     """可以查詢你的所有 spotify 裝置，取得個別裝置的 id 與名稱"""
 
-    devices = sp.devices()["devices"]
+    devices = devices_cache.get("devices")
+    if devices is None:
+        devices = (await spotify_call("devices", coalesce=True))["devices"]
+        if devices: # 剛打開的裝置要馬上查得到，所以不快取空清單
+            devices_cache.put("devices", devices)
     if not devices:
         return "No devices found."
-    return json.dumps(devices)
+    return compact_json(devices)
 
 @mcp.tool()
-async def spotify_search(query: str) -> str:
+async def spotify_search(query: str, fields: list[str] | None = None) -> str:
     """可以搜尋 spotify 上的音樂，並取 3 首音樂的曲名、藝人名、
-    專輯名以及播放時需要的 rui
+    專輯名、長度以及播放時需要的 uri
 
     Args:
         query: 搜尋關鍵字
+        fields: 要傳回的欄位，省略時傳回預設欄位，可用的欄位有
+                name、artists、uri、album、duration_ms、
+                release_date、popularity、explicit
     """
+    try:
+        fields = check_fields(fields)
+    except ValueError as e:
+        return str(e)
 
-    results = sp.search(q=query, type="track", limit=3)
+    query = normalize_query(query)
+    results = search_cache.get(query)
+    if results is None:
+        results = await spotify_call(
+            "search", q=query, type="track", limit=3, coalesce=True
+        )
+        search_cache.put(query, results)
     items = results["tracks"]["items"]
-    tracks = []
-    for i, item in enumerate(items):
-        tracks.append({
-            "no": i,
-            "name": item["name"],
-            "artists": item["artists"],
-            "uri": item["uri"],
-            "album": item["album"]["name"]
-        })
-    if not tracks:
+    if not items:
         return "No tracks found."
-    return json.dumps(tracks)
+    tracks = [
+        {"no": i, **project_track(item, fields)}
+        for i, item in enumerate(items)
+    ]
+    output = compact_json(tracks)
+    record_payload(lambda: [{
+        "no": i,
+        "name": item["name"],
+        "artists": item["artists"],
+        "uri": item["uri"],
+        "album": item["album"]["name"]
+    } for i, item in enumerate(items)], output)
+    return output
 
 @mcp.tool()
 async def spotify_play(uri: str, device_id: str) -> str:
@@ -60,7 +203,7 @@ async def spotify_play(uri: str, device_id: str) -> str:
         uri: 音樂的 uri
         device_id: 播放裝置的 id
     """
-    sp.start_playback(device_id=device_id, uris=[uri])
+    await playback_call("start_playback", device_id=device_id, uris=[uri])
     return f"Playing {uri} on device {device_id}"
 
 @mcp.tool()
@@ -70,7 +213,7 @@ async def spotify_pause(device_id: str) -> str:
     Args:
         device_id: 播放裝置的 id
     """
-    sp.pause_playback(device_id=device_id)
+    await playback_call("pause_playback", device_id=device_id)
     return f"Paused playback on device {device_id}"
 
 @mcp.tool()
@@ -80,13 +223,22 @@ async def spotify_resume(device_id: str) -> str:
     Args:
         device_id: 播放裝置的 id
     """
-    sp.start_playback(device_id=device_id)
+    await playback_call("start_playback", device_id=device_id)
     return f"Resumed playback on device {device_id}"
 
 @mcp.tool()
-async def spotify_now_playing() -> str:
-    """可以查詢 spotify 上正在播放的音樂"""
-    current_playback = sp.current_playback()
+async def spotify_now_playing(fields: list[str] | None = None) -> str:
+    """可以查詢 spotify 上正在播放的音樂
+
+    Args:
+        fields: 要傳回的欄位，用法與 spotify_search 相同
+    """
+    try:
+        fields = check_fields(fields)
+    except ValueError as e:
+        return str(e)
+
+    current_playback = await spotify_call("current_playback", coalesce=True)
     if not current_playback:
         return "No music is currently playing."
     
@@ -94,12 +246,33 @@ async def spotify_now_playing() -> str:
     if not track:
         return "No music is currently playing."
     
-    return json.dumps({
+    output = compact_json(project_track(track, fields))
+    record_payload(lambda: {
         "name": track["name"],
         "artists": track["artists"],
         "album": track["album"]["name"],
         "uri": track["uri"]
-    })  
+    }, output)
+    return output
+
+@mcp.tool()
+async def spotify_cache_stats() -> str:
+    """可以查詢裝置清單與搜尋結果快取的命中統計，
+    以及精簡輸出省下的位元組與 token 數（需設定 SPOTIFY_PAYLOAD_STATS=1）"""
+    payload = {"enabled": PAYLOAD_STATS}
+    if PAYLOAD_STATS:
+        payload.update(
+            payload_stats,
+            saved_bytes=payload_stats["full_bytes"]
+                        - payload_stats["compact_bytes"],
+            saved_tokens=payload_stats["full_tokens"]
+                         - payload_stats["compact_tokens"],
+        )
+    return json.dumps({
+        "devices": devices_cache.stats(),
+        "search": search_cache.stats(),
+        "payload": payload,
+    })
 
 if __name__ == "__main__":
     # Initialize and run the server
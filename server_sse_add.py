@@ -1,5 +1,5 @@
 from mcp.server.fastmcp import FastMCP, Context
-from rich.pretty import pprint
+from request_trace import Tracer
 
 # from fastapi import FastAPI, Header
 
@@ -7,19 +7,22 @@ from rich.pretty import pprint
 # app = FastAPI()
 mcp = FastMCP("My SSE Server", port=8080)
 
+# 原本在工具中以 pprint 印出 Context 的除錯資訊改由 tracer 記錄，
+# 預設關閉，例如 MCP_TRACE=detail MCP_TRACE_SAMPLE=1 uv run server_sse_add.py
+# 會記錄每次呼叫的 client_id、request_id、meta 與 client_params
+tracer = Tracer.from_env()
+
 # Define a tool
 @mcp.tool()
+@tracer.traced
 def add(a: int, b: int, ctx:Context) -> int:
     """Add two numbers"""
-    pprint(ctx.client_id)
-    pprint(ctx.request_id)
-    pprint(ctx.request_context)
-    pprint(ctx.session.client_params)
     return a + b
 
 
-# Mount the SSE app to your FastAPI application
-mcp.run(transport='sse')
+if __name__ == "__main__":
+    # Mount the SSE app to your FastAPI application
+    mcp.run(transport='sse')
 # app.mount("/", mcp.sse_app())
 # import uvicorn
 
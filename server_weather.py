@@ -1,28 +1,161 @@
 from typing import Any
+from contextlib import asynccontextmanager
+import asyncio
+import importlib.util
+import os
+import random
+import weakref
 
 import httpx
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 
-# Initialize FastMCP server
-mcp = FastMCP("weather")
+from weather_cache import (AlertCache, GridpointCache, ResponseCache,
+                           default_db_path)
 
 # Constants
-NWS_API_BASE = "https://api.weather.gov"
+NWS_API_BASE = os.getenv("NWS_API_BASE", "https://api.weather.gov")
 USER_AGENT = "weather-app/1.0"
+REQUEST_TIMEOUT = 30.0
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60.0
+MAX_RETRIES = 3        # Retries after the first attempt for 429/5xx/network errors
+BACKOFF_BASE = 0.5     # Seconds; doubled on every retry
+BACKOFF_MAX = 8.0      # Upper bound for a single wait, including Retry-After
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_BATCH_LOCATIONS = 50
+BATCH_CONCURRENCY = 8  # NWS requests in flight per batch call
+# HTTP/2 needs h2, installed with the httpx[http2] project dependency;
+# fall back to HTTP/1.1 when running outside the project environment
+HTTP2 = importlib.util.find_spec("h2") is not None
 
-async def make_nws_request(url: str) -> dict[str, Any] | None:
-    """Make a request to the NWS API with proper error handling."""
-    headers = {
-        "User-Agent": USER_AGENT,
-        "Accept": "application/geo+json"
-    }
-    async with httpx.AsyncClient() as client:
+http_client: httpx.AsyncClient | None = None
+_lifespan_users = 0
+
+# Location -> forecast URL, persisted across restarts
+gridpoints = GridpointCache(default_db_path())
+# Forecast payloads, kept as long as NWS's Cache-Control/Expires allow
+response_cache = ResponseCache()
+# Alert feeds with their validators, and formatted alerts by id
+alert_cache = AlertCache()
+# Session -> state -> alert ids returned last time, for only_new
+seen_alerts: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the keep-alive client shared by every NWS request."""
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        headers={
+            "User-Agent": USER_AGENT,
+            "Accept": "application/geo+json"
+        },
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=REQUEST_TIMEOUT,
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it when used outside the lifespan."""
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Open the shared HTTP client on startup and close it on shutdown.
+
+    The low-level server enters the lifespan once per session, so the
+    client is only closed when the last session ends.
+    """
+    global http_client, _lifespan_users
+    get_http_client()
+    _lifespan_users += 1
+    try:
+        yield
+    finally:
+        _lifespan_users -= 1
+        if _lifespan_users == 0 and http_client is not None:
+            await http_client.aclose()
+            http_client = None
+
+# Initialize FastMCP server
+mcp = FastMCP("weather", lifespan=lifespan)
+
+def retry_delay(attempt: int, response: httpx.Response | None) -> float:
+    """Seconds to wait before the next attempt, honoring Retry-After."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+    delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0) # Jitter spreads out retries
+
+async def send_nws_request(url: str,
+                           headers: dict[str, str] | None = None
+                           ) -> httpx.Response | None:
+    """Send a GET to the NWS API, retrying throttled or failed attempts.
+
+    Returns the final response, or None when every attempt failed.
+    """
+    client = get_http_client()
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
         try:
-            response = await client.get(url, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            return response.json()
+            response = await client.get(url, headers=headers)
+            if response.status_code not in RETRY_STATUS:
+                return response
+        except httpx.TransportError:
+            pass
         except Exception:
             return None
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(retry_delay(attempt, response))
+    return None
+
+def decode_response(response: httpx.Response | None) -> dict[str, Any] | None:
+    """Return the JSON body of a successful response, otherwise None."""
+    if response is None:
+        return None
+    try:
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return None
+
+async def make_nws_request(url: str) -> dict[str, Any] | None:
+    """Make a request to the NWS API with proper error handling."""
+    return decode_response(await send_nws_request(url))
+
+async def cached_nws_request(url: str) -> dict[str, Any] | None:
+    """Like make_nws_request, but reuse payloads while NWS says they are fresh."""
+    data = response_cache.get(url)
+    if data is not None:
+        return data
+    response = await send_nws_request(url)
+    data = decode_response(response)
+    if data is not None:
+        response_cache.put(url, data, response.headers)
+    return data
+
+async def resolve_forecast_url(latitude: float, longitude: float) -> str | None:
+    """Map a location to its forecast URL, asking /points only on a cache miss."""
+    forecast_url = gridpoints.get(latitude, longitude)
+    if forecast_url is not None:
+        return forecast_url
+    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
+    points_data = await make_nws_request(points_url)
+    if not points_data:
+        return None
+    forecast_url = points_data["properties"]["forecast"]
+    gridpoints.put(latitude, longitude, forecast_url)
+    return forecast_url
 
 def format_alert(feature: dict) -> str:
     """Format an alert feature into a readable string."""
@@ -35,48 +168,74 @@ Description: {props.get('description', 'No description available')}
 Instructions: {props.get('instruction', 'No specific instructions provided')}
 """
 
-@mcp.tool()
-async def get_alerts(state: str) -> str:
-    """Get weather alerts for a US state.
+def alert_id(feature: dict) -> str:
+    return feature.get("id") or feature["properties"].get("id", "")
 
-    Args:
-        state: Two-letter US state code (e.g. CA, NY)
+async def fetch_alerts(state: str) -> list[tuple[str, str]] | None:
+    """Return [(alert id, formatted alert)] for a state.
+
+    A fresh feed is reused as is; a stale one is revalidated with
+    If-None-Match/If-Modified-Since so an unchanged feed costs a 304.
+    Only alerts not seen before are formatted.
     """
+    feed = alert_cache.feed(state)
+    if feed is not None and feed.fresh():
+        return feed.alerts
+
     url = f"{NWS_API_BASE}/alerts/active/area/{state}"
-    data = await make_nws_request(url)
+    headers = feed.validators() if feed is not None else None
+    response = await send_nws_request(url, headers)
+    if response is not None and response.status_code == 304 and feed:
+        feed.revalidated(response.headers, alert_cache.max_ttl)
+        return feed.alerts
 
+    data = decode_response(response)
     if not data or "features" not in data:
-        return "Unable to fetch alerts or no alerts found."
+        return None
 
-    if not data["features"]:
-        return "No active alerts for this state."
-
-    alerts = [format_alert(feature) for feature in data["features"]]
-    return "\n---\n".join(alerts)
+    alerts = []
+    for feature in data["features"]:
+        key = alert_id(feature)
+        text = alert_cache.text(key) if key else None
+        if text is None:
+            text = format_alert(feature)
+            if key:
+                alert_cache.put_text(key, text)
+        alerts.append((key, text))
+    alert_cache.put_feed(state, alerts, response.headers)
+    return alerts
 
 @mcp.tool()
-async def get_forecast(latitude: float, longitude: float) -> str:
-    """Get weather forecast for a location.
+async def get_alerts(state: str, ctx: Context, only_new: bool = False) -> str:
+    """Get weather alerts for a US state.
 
     Args:
-        latitude: Latitude of the location
-        longitude: Longitude of the location
+        state: Two-letter US state code (e.g. CA, NY)
+        only_new: Only return alerts that were not in your previous
+            request for this state
     """
-    # First get the forecast grid endpoint
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = await make_nws_request(points_url)
+    state = state.upper()
+    alerts = await fetch_alerts(state)
 
-    if not points_data:
-        return "Unable to fetch forecast data for this location."
+    if alerts is None:
+        return "Unable to fetch alerts or no alerts found."
 
-    # Get the forecast URL from the points response
-    forecast_url = points_data["properties"]["forecast"]
-    forecast_data = await make_nws_request(forecast_url)
+    seen = seen_alerts.setdefault(ctx.session, {})
+    previous = seen.get(state, set())
+    seen[state] = {key for key, _ in alerts}
 
-    if not forecast_data:
-        return "Unable to fetch detailed forecast."
+    if only_new:
+        alerts = [(key, text) for key, text in alerts if key not in previous]
+        if not alerts:
+            return "No new alerts since your last request."
 
-    # Format the periods into a readable forecast
+    if not alerts:
+        return "No active alerts for this state."
+
+    return "\n---\n".join(text for _, text in alerts)
+
+def format_forecast(forecast_data: dict) -> str:
+    """Format the next periods of a forecast into a readable string."""
     periods = forecast_data["properties"]["periods"]
     forecasts = []
     for period in periods[:5]:  # Only show next 5 periods
@@ -90,6 +249,92 @@ Forecast: {period['detailedForecast']}
 
     return "\n---\n".join(forecasts)
 
+async def fetch_forecast(latitude: float,
+                         longitude: float) -> tuple[str | None, str | None]:
+    """Return (formatted forecast, None) or (None, error message)."""
+    # First get the forecast grid endpoint, usually straight from the cache
+    cached_grid = gridpoints.get(latitude, longitude) is not None
+    forecast_url = await resolve_forecast_url(latitude, longitude)
+
+    if not forecast_url:
+        return None, "Unable to fetch forecast data for this location."
+
+    forecast_data = await cached_nws_request(forecast_url)
+
+    if not forecast_data and cached_grid:
+        # The cached grid may be outdated; resolve it again once
+        gridpoints.discard(latitude, longitude)
+        forecast_url = await resolve_forecast_url(latitude, longitude)
+        if forecast_url:
+            forecast_data = await cached_nws_request(forecast_url)
+
+    if not forecast_data:
+        return None, "Unable to fetch detailed forecast."
+
+    return format_forecast(forecast_data), None
+
+@mcp.tool()
+async def get_forecast(latitude: float, longitude: float) -> str:
+    """Get weather forecast for a location.
+
+    Args:
+        latitude: Latitude of the location
+        longitude: Longitude of the location
+    """
+    forecast, error = await fetch_forecast(latitude, longitude)
+    return forecast or error
+
+@mcp.tool()
+async def get_weather_batch(coordinates: list[list[float]] | None = None,
+                            states: list[str] | None = None) -> str:
+    """Get forecasts for several locations and alerts for several US states
+    in one call.
+
+    Args:
+        coordinates: [latitude, longitude] pairs to get forecasts for
+        states: Two-letter US state codes (e.g. CA, NY) to get alerts for
+    """
+    coordinates = coordinates or []
+    states = states or []
+    if len(coordinates) + len(states) > MAX_BATCH_LOCATIONS:
+        return (f"Too many locations; at most {MAX_BATCH_LOCATIONS} "
+                f"per call.")
+    if not coordinates and not states:
+        return "No locations given."
+
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def forecast_section(pair: list[float]) -> str:
+        if len(pair) != 2:
+            return (f"=== Forecast for {pair} ===\n"
+                    f"Error: expected [latitude, longitude]")
+        latitude, longitude = pair
+        async with slots:
+            forecast, error = await fetch_forecast(latitude, longitude)
+        title = f"=== Forecast for {latitude}, {longitude} ==="
+        return f"{title}\n{forecast}" if forecast else f"{title}\nError: {error}"
+
+    async def alerts_section(state: str) -> str:
+        state = state.upper()
+        async with slots:
+            alerts = await fetch_alerts(state)
+        title = f"=== Alerts for {state} ==="
+        if alerts is None:
+            return f"{title}\nError: Unable to fetch alerts."
+        if not alerts:
+            return f"{title}\nNo active alerts for this state."
+        return title + "\n" + "\n---\n".join(text for _, text in alerts)
+
+    # Duplicates in the request are fetched once
+    pairs = list({GridpointCache.key(*pair) if len(pair) == 2 else str(pair):
+                  pair for pair in coordinates}.values())
+    codes = list(dict.fromkeys(state.upper() for state in states))
+    sections = await asyncio.gather(
+        *[forecast_section(pair) for pair in pairs],
+        *[alerts_section(state) for state in codes]
+    )
+    return "\n\n".join(sections)
+
 if __name__ == "__main__":
     # Initialize and run the server
     mcp.run(transport='stdio')
\ No newline at end of file
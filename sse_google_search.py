@@ -1,5 +1,6 @@
+import json
 from mcp.server.fastmcp import FastMCP
-from googlesearch import search
+from google_search import google_search, search_stats
 from starlette.applications import Starlette
 from starlette.routing import Mount
 
@@ -15,18 +16,21 @@ async def google_res(keyword: str, num_results: int = 5) -> str:
         keyword (str): 搜尋關鍵字
         num_results (int): 搜尋結果數量，預設為 5 筆
     """
-    content = ""
-    num_results = max(num_results, 5) # 最少 5 筆
-    for result in search( # 一一串接搜尋結果
-        keyword,
-        advanced=True,
-        num_results=num_results,
-        lang='zh-TW'
-    ):
-        # 使用 markdown 格式整理搜尋結果
-        content += (f"- [{result.title}]({result.url})\n"
-                    f"    {result.description}\n")
-    return content
+    # 在執行緒中搜尋並快取結果，相同的搜尋同時進行時只搜尋一次
+    return await google_search(keyword, num_results)
+
+@mcp.tool()
+async def google_search_stats() -> str:
+    """可以查詢 Google 搜尋排隊中的搜尋數（佇列深度）、限流次數
+    與搜尋結果快取的命中統計"""
+    return json.dumps(search_stats())
+
+def create_app():
+    """給 uvicorn 的 app factory
+
+    SSE 的 session 只存在建立連線的行程中，只能以單一 worker 執行
+    """
+    return mcp.sse_app()
 
 # app = Starlette(
 #     routes=[
@@ -0,0 +1,163 @@
+"""工具呼叫參數的解碼與驗證
+
+取代原本以 eval() 解析模型產生的參數：
+- 以 JSON 解析，可以正確處理 true/false/null，也不會執行任意程式碼
+- 有安裝 orjson 時改用 orjson 加速解析
+- 有安裝 jsonschema 時依工具的 inputSchema 驗證參數，
+  每個工具的驗證器只在第一次使用（或 schema 變動）時建立
+- 有安裝 fastjsonschema 時把 schema 編譯成 Python 函式，
+  參數正確時只執行編譯好的函式；不符合時才以 jsonschema 列出
+  所有錯誤，沒有 jsonschema 時使用 fastjsonschema 的錯誤訊息
+
+解析或驗證失敗時不丟出例外，而是傳回可以直接交給模型的錯誤訊息，
+讓模型修正參數後重新呼叫。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from jsonschema.exceptions import SchemaError
+    from jsonschema.validators import validator_for
+except ImportError:
+    SchemaError = None
+    validator_for = None
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+if orjson is not None:
+    loads = orjson.loads
+else:
+    loads = json.loads
+
+# schema 本身不合法時丟出的例外
+SCHEMA_ERRORS = tuple(
+    error for error in (
+        SchemaError,
+        fastjsonschema and fastjsonschema.JsonSchemaDefinitionException
+    ) if error is not None
+)
+
+_validators = {} # 工具鍵值 -> (schema, 驗證器)
+
+class SchemaValidator:
+    """單一工具的參數驗證器
+
+    有安裝 fastjsonschema 時先執行編譯好的函式，參數不符合時才以
+    jsonschema 逐一列出錯誤；兩者的判斷不同時（例如 fastjsonschema
+    不支援的寫法）以 jsonschema 為準。
+    """
+    def __init__(self, schema):
+        """
+        Raises:
+            SCHEMA_ERRORS 其中之一: schema 本身不合法
+        """
+        self.validator = None # jsonschema 的驗證器
+        self.compiled = None  # fastjsonschema 編譯好的函式
+        if validator_for is not None:
+            cls = validator_for(schema)
+            cls.check_schema(schema)
+            self.validator = cls(schema)
+        if fastjsonschema is not None:
+            try:
+                # 與 jsonschema 相同，不填入預設值也不檢查 format
+                self.compiled = fastjsonschema.compile(
+                    schema, use_default=False, use_formats=False
+                )
+            except Exception as e:
+                # 無法編譯的 schema 改用 jsonschema 驗證
+                if self.validator is None:
+                    raise fastjsonschema.JsonSchemaDefinitionException(
+                        str(e)
+                    ) from e
+
+    def errors(self, instance):
+        """傳回參數不符合 schema 的錯誤，符合時傳回空串列"""
+        if self.compiled is not None:
+            try:
+                self.compiled(instance)
+                return []
+            except fastjsonschema.JsonSchemaValueException as e:
+                if self.validator is None:
+                    return [{
+                        "path": "/".join(str(part) for part in e.path[1:]),
+                        "message": e.message
+                    }]
+        elif self.validator.is_valid(instance):
+            return []
+        return [{
+            "path": "/".join(str(part) for part in error.absolute_path),
+            "message": error.message
+        } for error in self.validator.iter_errors(instance)]
+
+def get_validator(key, schema):
+    """取得工具的參數驗證器，schema 沒變就沿用已建立的驗證器
+
+    Args:
+        key: 工具的鍵值，多個伺服器時應包含伺服器名稱
+        schema: 工具的 inputSchema
+
+    Returns:
+        SchemaValidator，沒有 schema 或 jsonschema 與 fastjsonschema
+        都沒有安裝時傳回 None
+
+    Raises:
+        SCHEMA_ERRORS 其中之一: schema 本身不合法
+    """
+    if not SCHEMA_ERRORS or not schema:
+        return None
+    cached = _validators.get(key)
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+    validator = SchemaValidator(schema)
+    _validators[key] = (schema, validator)
+    return validator
+
+def error_output(message, errors=None, code="invalid_arguments"):
+    """建立交給模型的錯誤訊息"""
+    content = {"error": code, "message": message}
+    if errors:
+        content["errors"] = errors
+    return json.dumps(content, ensure_ascii=False)
+
+def decode_arguments(key, arguments, schema=None):
+    """解碼並驗證模型產生的工具參數
+
+    Args:
+        key: 工具的鍵值，用來快取驗證器
+        arguments: 模型產生的 JSON 字串
+        schema: 工具的 inputSchema，None 表示不驗證
+
+    Returns:
+        (tool_args, error)，成功時 error 為 None；
+        失敗時 tool_args 為 None，error 是要交給模型的錯誤訊息
+    """
+    try:
+        tool_args = loads(arguments or "{}")
+    except ValueError as e:
+        return None, error_output(f"Arguments are not valid JSON: {e}")
+    if not isinstance(tool_args, dict):
+        return None, error_output("Arguments must be a JSON object.")
+
+    try:
+        validator = get_validator(key, schema)
+    except SCHEMA_ERRORS as e:
+        # 伺服器提供的 schema 有誤，不中斷整個問答，交給模型處理
+        return None, error_output(
+            "The tool's input schema is invalid: "
+            f"{getattr(e, 'message', None) or e}",
+            code="invalid_schema"
+        )
+    if validator is not None:
+        errors = validator.errors(tool_args)
+        if errors:
+            return None, error_output(
+                "Arguments do not match the tool's input schema.", errors
+            )
+    return tool_args, None
@@ -0,0 +1,106 @@
+"""MCP 工具清單快取
+
+每個 session 只在第一次需要時呼叫 list_tools()，之後直接使用快取，
+直到伺服器送出 notifications/tools/list_changed 通知或超過 TTL
+才重新取得。
+
+設定 MCP_TOOL_SNAPSHOT_DIR 環境變數時，工具清單也會依伺服器的
+啟動指令或網址存到磁碟，下次啟動可以省下取得工具清單的往返。
+"""
+import hashlib
+import json
+import os
+import time
+
+from mcp import types
+
+SNAPSHOT_DIR = os.getenv("MCP_TOOL_SNAPSHOT_DIR") # 未設定則不使用磁碟快取
+SNAPSHOT_TTL = 24 * 60 * 60 # 磁碟快取的有效秒數
+
+def snapshot_key(*parts):
+    """以伺服器的啟動指令與參數（或網址）組成磁碟快取的鍵值"""
+    return json.dumps(parts, ensure_ascii=False)
+
+class ToolCatalog:
+    """單一 MCP session 的工具清單快取"""
+    def __init__(self, key=None, ttl=None, snapshot_dir=SNAPSHOT_DIR):
+        """
+        Args:
+            key: 磁碟快取的鍵值，None 表示不使用磁碟快取
+            ttl: 記憶體快取的有效秒數，None 表示只依通知更新
+            snapshot_dir: 磁碟快取的資料夾，None 表示不使用磁碟快取
+        """
+        self.session = None # 連線後再指定
+        self.ttl = ttl
+        self._tools = None
+        self._loaded_at = 0.0
+        self._snapshot_path = None
+        if key is not None and snapshot_dir:
+            digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+            self._snapshot_path = os.path.join(snapshot_dir, f"{digest}.json")
+
+    async def get(self):
+        """取得工具清單，快取失效時才向伺服器重新取得"""
+        if self._tools is not None and not self._expired():
+            return self._tools
+        if self._tools is None:
+            tools = self._load_snapshot()
+            if tools is not None:
+                self._set(tools)
+                return self._tools
+
+        response = await self.session.list_tools()
+        self._set(response.tools)
+        self._save_snapshot()
+        return self._tools
+
+    def invalidate(self):
+        """清除快取，下次取得工具清單時會重新向伺服器取得"""
+        self._tools = None
+        if self._snapshot_path is not None:
+            try:
+                os.remove(self._snapshot_path)
+            except FileNotFoundError:
+                pass
+
+    async def handle_message(self, message):
+        """傳給 ClientSession 的 message_handler，收到工具清單變動通知時清除快取"""
+        if (isinstance(message, types.ServerNotification) and
+            isinstance(message.root, types.ToolListChangedNotification)):
+            self.invalidate()
+
+    def _set(self, tools):
+        self._tools = tools
+        self._loaded_at = time.monotonic()
+
+    def _expired(self):
+        return (self.ttl is not None and
+                time.monotonic() - self._loaded_at > self.ttl)
+
+    def _load_snapshot(self):
+        """讀取未過期的磁碟快取，沒有或無法使用時傳回 None"""
+        if self._snapshot_path is None:
+            return None
+        try:
+            if time.time() - os.path.getmtime(self._snapshot_path) > SNAPSHOT_TTL:
+                return None
+            with open(self._snapshot_path, "r", encoding="utf-8") as f:
+                return [types.Tool.model_validate(tool) for tool in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+    def _save_snapshot(self):
+        """把工具清單寫入磁碟快取，先寫暫存檔再取代以免留下不完整的檔案"""
+        if self._snapshot_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._snapshot_path), exist_ok=True)
+            tmp_path = f"{self._snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    [tool.model_dump(mode="json") for tool in self._tools],
+                    f, ensure_ascii=False
+                )
+            os.replace(tmp_path, self._snapshot_path)
+        except OSError:
+            pass
@@ -0,0 +1,154 @@
+"""工具路由表
+
+連線時建立一次，以字典把工具名稱對應到提供工具的 MCPClient，
+每次問答不必重新串接工具清單，也不必逐一搜尋每個伺服器。
+"""
+import re
+import sys
+
+ALIAS_SEP = '.' # 命名空間別名的分隔字元，例如 spotify_helper.spotify_play
+
+def safe_name(name):
+    """轉換成 OpenAI 函式名稱允許的字元（英數字、_ 與 -）"""
+    return re.sub(r'[^a-zA-Z0-9_-]', '_', name)[:64]
+
+class ToolRouter:
+    """工具名稱與 MCPClient 的對照表
+
+    - 只有一個伺服器提供的工具直接以原名稱提供給模型
+    - 名稱重複的工具改以 "伺服器_工具" 的別名提供給模型，別名與
+      其他工具名稱或別名相同時加上 "_2"、"_3" 等字尾
+    - 任何工具都可以用 "伺服器.工具" 的命名空間別名呼叫
+    """
+    def __init__(self, clients=()):
+        self._providers = {}     # 工具名稱 -> 提供該工具的 MCPClient 串列
+        self._routes = {}        # 可呼叫的名稱 -> (MCPClient, 工具名稱)
+        self._schemas = {}       # 原名稱 -> 工具的 schema
+        self._shared = set()     # 由多個伺服器提供、需要別名的工具名稱
+        self._aliases = {}       # 別名 -> (MCPClient, 工具名稱)
+        self._alias_schemas = {} # 別名 -> 換成別名的 schema
+        self._owned = {}         # 伺服器名稱 -> 該伺服器目前登錄的工具名稱
+        self._tools = None       # 快取的工具清單，有變動時才重建
+        for client in clients:
+            self.update(client)
+
+    @property
+    def tools(self):
+        """提供給模型的工具清單
+
+        依名稱排序，不受伺服器連線與更新的先後影響，每次請求的
+        工具清單都相同，才能命中 OpenAI 的提示快取
+        """
+        if self._tools is None:
+            schemas = {**self._schemas, **self._alias_schemas}
+            self._tools = [schemas[name] for name in sorted(schemas)]
+        return self._tools
+
+    def resolve(self, name):
+        """找出工具對應的 MCPClient 與伺服器端的工具名稱
+
+        Returns:
+            (MCPClient, 工具名稱)，找不到時傳回 None
+        """
+        return self._routes.get(name) or self._aliases.get(name)
+
+    def update(self, client):
+        """登錄或更新單一伺服器的工具，只重建受影響的項目"""
+        self._replace(client, set(client.tool_names))
+
+    def remove(self, client):
+        """移除單一伺服器的所有工具"""
+        self._replace(client, set())
+        del self._owned[client.name]
+
+    @staticmethod
+    def alias(client, name):
+        """工具的命名空間別名"""
+        return f"{client.name}{ALIAS_SEP}{name}"
+
+    def _replace(self, client, new_names):
+        """把伺服器登錄的工具換成 new_names"""
+        old_names = self._owned.get(client.name, set())
+        affected = old_names | new_names
+        for name in affected:
+            self._clear(name)
+        for name in old_names - new_names:
+            self._providers[name].remove(client)
+        for name in new_names - old_names:
+            self._providers.setdefault(name, []).append(client)
+        self._owned[client.name] = new_names
+        for name in affected:
+            self._build(name)
+        self._build_aliases()
+        self._tools = None
+
+    def _clear(self, name):
+        """清除單一工具名稱的路由與 schema"""
+        self._routes.pop(name, None)
+        self._schemas.pop(name, None)
+        self._shared.discard(name)
+        for client in self._providers.get(name, []):
+            self._routes.pop(self.alias(client, name), None)
+
+    def _build(self, name):
+        """建立單一工具名稱的路由，只有一個伺服器提供時以原名稱提供給模型"""
+        providers = self._providers.get(name, [])
+        if not providers:
+            self._providers.pop(name, None)
+            return
+
+        for client in providers:
+            self._routes[self.alias(client, name)] = (client, name)
+        if len(providers) == 1:
+            client = providers[0]
+            self._routes[name] = (client, name)
+            self._schemas[name] = self._schema(client, name, name)
+            return
+
+        print(
+            f"Warning: 工具 {name} 同時由 "
+            f"{', '.join(client.name for client in providers)} 提供，"
+            "改用別名區分",
+            file=sys.stderr
+        )
+        self._shared.add(name)
+
+    def _build_aliases(self):
+        """重新分配名稱重複的工具的別名
+
+        原名稱優先，別名依工具與伺服器名稱的順序分配，
+        結果不受伺服器連線與更新的先後影響。
+        名稱重複的工具通常很少，每次全部重建。
+        """
+        self._aliases = {}
+        self._alias_schemas = {}
+        for name in sorted(self._shared):
+            for client in sorted(self._providers[name],
+                                 key=lambda client: client.name):
+                exposed = self._unique(safe_name(self.alias(client, name)))
+                self._aliases[exposed] = (client, name)
+                self._alias_schemas[exposed] = self._schema(
+                    client, name, exposed
+                )
+
+    def _unique(self, exposed):
+        """別名與其他工具名稱或別名相同時加上字尾"""
+        base, number = exposed, 1
+        while exposed in self._schemas or exposed in self._aliases:
+            number += 1
+            suffix = f"_{number}"
+            exposed = base[:64 - len(suffix)] + suffix
+        if exposed != base:
+            print(f"Warning: 別名 {base} 與其他工具重複，改用 {exposed}",
+                  file=sys.stderr)
+        return exposed
+
+    @staticmethod
+    def _schema(client, name, exposed):
+        """取得工具的 schema，必要時換成別名"""
+        for tool in client.tools:
+            if tool["name"] == name:
+                break
+        if exposed == name:
+            return tool
+        return {**tool, "name": exposed}
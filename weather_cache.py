@@ -0,0 +1,247 @@
+"""Caches used by the weather server.
+
+- GridpointCache: rounded lat/lon -> forecast URL. The /points mapping
+  practically never changes, so it lives in an in-memory LRU backed by
+  sqlite and survives restarts.
+- ResponseCache: short-lived cache of NWS payloads whose lifetime comes
+  from the Cache-Control / Expires headers NWS sends.
+- AlertCache: per-state alert feeds with their ETag/Last-Modified
+  validators, plus formatted alert text keyed by alert id.
+"""
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+import os
+import sqlite3
+import time
+from typing import Any
+
+GRID_PRECISION = 4  # NWS accepts at most 4 decimals (about 11 m)
+
+def default_db_path() -> str:
+    return os.getenv(
+        "NWS_GRIDPOINT_DB",
+        os.path.join(os.path.expanduser("~"), ".cache", "mcp_test",
+                     "gridpoints.sqlite3")
+    )
+
+class GridpointCache:
+    """LRU cache of forecast URLs keyed by rounded coordinates."""
+
+    def __init__(self, path: str | None = None, max_entries: int = 1024,
+                 max_disk_entries: int = 100_000):
+        """
+        Args:
+            path: sqlite file for the on-disk copy, None keeps it in memory only
+            max_entries: entries kept in memory
+            max_disk_entries: rows kept on disk, least recently used go first
+        """
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(path)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS gridpoints ("
+                    "key TEXT PRIMARY KEY, forecast_url TEXT NOT NULL, "
+                    "used REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error:
+                self._db = None # Fall back to memory only
+
+    @staticmethod
+    def key(latitude: float, longitude: float) -> str:
+        return (f"{round(latitude, GRID_PRECISION)},"
+                f"{round(longitude, GRID_PRECISION)}")
+
+    def get(self, latitude: float, longitude: float) -> str | None:
+        key = self.key(latitude, longitude)
+        url = self._entries.get(key)
+        if url is not None:
+            self._entries.move_to_end(key)
+            return url
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT forecast_url FROM gridpoints WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE gridpoints SET used = ? WHERE key = ?",
+                (time.time(), key)
+            )
+            self._db.commit()
+        except sqlite3.Error:
+            return None
+        self._remember(key, row[0])
+        return row[0]
+
+    def put(self, latitude: float, longitude: float, url: str) -> None:
+        key = self.key(latitude, longitude)
+        self._remember(key, url)
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO gridpoints VALUES (?, ?, ?)",
+                (key, url, time.time())
+            )
+            self._db.execute(
+                "DELETE FROM gridpoints WHERE key IN (SELECT key FROM "
+                "gridpoints ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+            self._db.commit()
+        except sqlite3.Error:
+            pass
+
+    def discard(self, latitude: float, longitude: float) -> None:
+        """Forget a mapping, e.g. when its forecast URL stopped working."""
+        key = self.key(latitude, longitude)
+        self._entries.pop(key, None)
+        if self._db is None:
+            return
+        try:
+            self._db.execute("DELETE FROM gridpoints WHERE key = ?", (key,))
+            self._db.commit()
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, key: str, url: str) -> None:
+        self._entries[key] = url
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+def cache_ttl(headers, now: float | None = None) -> float:
+    """Seconds a response may be reused according to its headers."""
+    cache_control = headers.get("Cache-Control", "")
+    directives = {}
+    for part in cache_control.split(","):
+        name, _, value = part.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+    if "no-store" in directives or "no-cache" in directives:
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(float(directives[name]), 0.0)
+            except ValueError:
+                return 0.0
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            expires_at = parsedate_to_datetime(expires).timestamp()
+            date = headers.get("Date")
+            if date:
+                now = parsedate_to_datetime(date).timestamp()
+            elif now is None:
+                now = time.time()
+            return max(expires_at - now, 0.0)
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+class ResponseCache:
+    """Payload cache that honors the HTTP freshness headers."""
+
+    def __init__(self, max_entries: int = 256, max_ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, url: str) -> Any | None:
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[url]
+            return None
+        self._entries.move_to_end(url)
+        return data
+
+    def put(self, url: str, data: Any, headers) -> None:
+        ttl = min(cache_ttl(headers), self.max_ttl)
+        if ttl <= 0:
+            return
+        self._entries[url] = (time.monotonic() + ttl, data)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class AlertFeed:
+    """The last alert feed seen for one state."""
+
+    def __init__(self, alerts: list[tuple[str, str]], headers,
+                 max_ttl: float):
+        self.alerts = alerts # [(alert id, formatted text)]
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
+        self.expires_at = time.monotonic() + min(cache_ttl(headers), max_ttl)
+
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def validators(self) -> dict[str, str]:
+        """Headers that turn the next fetch into a conditional request."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def revalidated(self, headers, max_ttl: float) -> None:
+        """Record a 304: keep the alerts, refresh validators and lifetime."""
+        self.etag = headers.get("ETag", self.etag)
+        self.last_modified = headers.get("Last-Modified", self.last_modified)
+        self.expires_at = time.monotonic() + min(cache_ttl(headers), max_ttl)
+
+class AlertCache:
+    """Alert feeds by state and formatted alerts by id.
+
+    Alerts keep their id for as long as they are active (updates are
+    issued as new alerts), so the formatted text of an id never changes
+    and is shared between states and between refreshes of a feed.
+    """
+
+    def __init__(self, max_states: int = 64, max_alerts: int = 4096,
+                 max_ttl: float = 300.0):
+        self.max_states = max_states
+        self.max_alerts = max_alerts
+        self.max_ttl = max_ttl
+        self._feeds: OrderedDict[str, AlertFeed] = OrderedDict()
+        self._texts: OrderedDict[str, str] = OrderedDict()
+
+    def feed(self, state: str) -> AlertFeed | None:
+        feed = self._feeds.get(state)
+        if feed is not None:
+            self._feeds.move_to_end(state)
+        return feed
+
+    def put_feed(self, state: str, alerts: list[tuple[str, str]],
+                 headers) -> AlertFeed:
+        feed = AlertFeed(alerts, headers, self.max_ttl)
+        self._feeds[state] = feed
+        self._feeds.move_to_end(state)
+        while len(self._feeds) > self.max_states:
+            self._feeds.popitem(last=False)
+        return feed
+
+    def text(self, alert_id: str) -> str | None:
+        text = self._texts.get(alert_id)
+        if text is not None:
+            self._texts.move_to_end(alert_id)
+        return text
+
+    def put_text(self, alert_id: str, text: str) -> None:
+        self._texts[alert_id] = text
+        self._texts.move_to_end(alert_id)
+        while len(self._texts) > self.max_alerts:
+            self._texts.popitem(last=False)